@@ -6,3 +6,12 @@ load_dotenv()
 
 DB_PASSWORD = os.environ.get('POSTGRES_PASSWORD')
 DB_USER = os.environ.get('POSTGRES_USER')
+DB_HOST = os.environ.get('POSTGRES_HOST', '127.0.0.1')
+DB_PORT = os.environ.get('POSTGRES_PORT', '5431')
+# comma separated host:port list of streaming replicas of the database above
+DB_REPLICAS = [replica for replica in os.environ.get('POSTGRES_REPLICAS', '').split(',') if replica]
+
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 1025))
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
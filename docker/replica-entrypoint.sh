@@ -0,0 +1,12 @@
+#!/bin/sh
+# Clone the primary on first start, then run as a hot standby of it.
+set -e
+if [ ! -s "$PGDATA/PG_VERSION" ]; then
+    until PGPASSWORD="$POSTGRES_PASSWORD" pg_basebackup \
+        -h db -p 5432 -U "$POSTGRES_USER" -D "$PGDATA" -R -X stream; do
+        echo "Waiting for the primary..."
+        sleep 2
+    done
+    chmod 700 "$PGDATA"
+fi
+exec postgres -c hot_standby=on
@@ -0,0 +1,201 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import orjson
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from django.db import transaction
+from django.http import HttpResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.authentication import get_authorization_header
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+
+from .authentication import TokenUser, decode_token, issue_tokens
+from .cache import aget_cached_catalog, aset_cached_catalog
+from .catalog import catalog_page_offers, group_catalog_offers, catalog_products
+from .filters import CatalogFilter
+from .models import User, Contact
+from .notifications import queue_confirmation
+from .pagination import KeysetPagination
+from .renderers import default
+from .serializers import UserSerializer, ContactSerializer
+
+
+# PBKDF2 runs here instead of on the event loop; the pool size bounds how
+# many CPU-bound hashes a worker runs at once.
+password_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASHING_WORKERS, thread_name_prefix='password-hashing'
+)
+
+
+async def run_hasher(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(password_executor, partial(func, *args))
+
+
+def json_response(data, status=200, headers=None):
+    return HttpResponse(
+        orjson.dumps(data, default=default), content_type='application/json', status=status, headers=headers
+    )
+
+
+def parse_body(request):
+    if request.content_type == 'application/json':
+        try:
+            return orjson.loads(request.body or b'{}')
+        except orjson.JSONDecodeError:
+            raise exceptions.ParseError('JSON parse error')
+    return request.POST.dict()
+
+
+async def authenticate(request):
+    """Async counterpart of the REST_FRAMEWORK authentication classes."""
+    auth = get_authorization_header(request).split()
+    if len(auth) != 2:
+        return None
+    keyword, key = auth[0].lower(), auth[1].decode()
+    if keyword == b'bearer':
+        return TokenUser(decode_token(key, 'access'))
+    if keyword == b'token':
+        token = await Token.objects.select_related('user').filter(key=key).afirst()
+        if token is None or not token.user.is_active:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        return token.user
+    return None
+
+
+class AsyncAPIView(View):
+    """Base for the async views: CSRF exempt like APIView, API errors rendered as JSON."""
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            detail = exc.detail if isinstance(exc.detail, (dict, list)) else {'detail': exc.detail}
+            return json_response(detail, status=exc.status_code)
+
+
+class AsyncRegisterView(AsyncAPIView):
+
+    async def post(self, request):
+        serializer = UserSerializer(data=parse_body(request))
+        if not await sync_to_async(serializer.is_valid)():
+            return json_response(serializer.errors, status=400)
+
+        data = dict(serializer.validated_data)
+        password = data.pop('password')
+        user = User(**data)
+        user.email = User.objects.normalize_email(user.email)
+        user.password = await run_hasher(make_password, password)
+        token = await sync_to_async(self.create_user)(user)
+        return json_response({'Status': 'OK', 'token': token.key, **issue_tokens(user)}, status=201)
+
+    @staticmethod
+    def create_user(user):
+        # one transaction, like RegisterView: no user without a token and a queued confirmation
+        with transaction.atomic():
+            user.save()
+            token = Token.objects.create(user=user)
+            queue_confirmation(user)
+        return token
+
+
+class AsyncLoginView(AsyncAPIView):
+
+    async def post(self, request):
+        data = parse_body(request)
+        email, password = data.get('email'), data.get('password')
+        if not email or not password:
+            return json_response({'non_field_errors': ["Must include 'email' and 'password'."]}, status=400)
+
+        user = await User.objects.filter(email=email).afirst()
+        if user is None:
+            # hash anyway so unknown emails take as long as wrong passwords
+            await run_hasher(make_password, password)
+        elif await run_hasher(check_password, password, user.password):
+            if not user.is_active:
+                return json_response({'non_field_errors': ['User account is disabled.']}, status=400)
+            token, created = await Token.objects.aget_or_create(user=user)
+            return json_response({'Status': 'OK', 'token': token.key, **issue_tokens(user)})
+        return json_response({'non_field_errors': ['Unable to log in with provided credentials.']}, status=400)
+
+
+class AsyncProductListView(AsyncAPIView):
+
+    async def get(self, request):
+        drf_request = Request(request)
+        catalog = CatalogFilter(drf_request.query_params)
+        data, version = await aget_cached_catalog(drf_request, catalog.shops)
+        if data is not None:
+            return json_response(data, headers={'X-Cache': 'HIT'})
+
+        paginator = KeysetPagination()
+        position = paginator.get_position(drf_request)
+        if settings.CATALOG_READ_MODEL:
+            offers = catalog_page_offers(catalog, position, paginator.page_size + 1)
+            products = group_catalog_offers([offer async for offer in offers])
+            page = paginator.get_page(products, lambda product: (product['name'], product['id']))
+            for product in page:
+                del product['id']
+        else:
+            page = await sync_to_async(self.get_normalized_page)(catalog, paginator, drf_request)
+
+        data = {'next': paginator.get_next_link(), 'results': page}
+        if catalog.with_facets and position is None:
+            data['facets'] = await sync_to_async(catalog.facets)()
+        await aset_cached_catalog(drf_request, data, version)
+        return json_response(data, headers={'X-Cache': 'MISS'})
+
+    @staticmethod
+    def get_normalized_page(catalog, paginator, request):
+        products = paginator.paginate_queryset(catalog.products().only('id', 'name'), request)
+        return catalog_products(products, catalog.offers())
+
+
+class AsyncContactView(AsyncAPIView):
+    fields = [field for field in ContactSerializer.Meta.fields if field != 'user']
+
+    async def get(self, request):
+        user = await authenticate(request)
+        if user is None:
+            return json_response({'Status': 'Failed', 'Error': 'Please register or login'})
+
+        contacts = [contact async for contact in Contact.objects.filter(user_id=user.id).values(*self.fields)]
+        return json_response(contacts)
+
+    async def post(self, request):
+        user = await authenticate(request)
+        if user is None:
+            return json_response({'Status': 'Failed', 'Error': 'Please register or login'})
+
+        data = parse_body(request)
+        if not {'first_name', 'city', 'street', 'phone'}.issubset(data):
+            return json_response({'Status': 'Failed', 'Error': 'Please add required fields'})
+
+        serializer = ContactSerializer(data={**data, 'user': user.id})
+        if await sync_to_async(serializer.is_valid)():
+            await sync_to_async(serializer.save)()
+            return json_response({'Status': 'Success'})
+        return json_response({'Status': 'Failed', 'Error': serializer.errors})
+
+    async def delete(self, request):
+        user = await authenticate(request)
+        if user is None:
+            return json_response({'Status': 'Failed', 'Error': 'Please register or login'})
+
+        id = parse_body(request).get('id')
+        if not id:
+            return json_response({'Status': 'Failed', 'Error': 'No id provided'})
+
+        deleted, _ = await Contact.objects.filter(id=id, user_id=user.id).adelete()
+        if not deleted:
+            return json_response({'Status': 'Failed', 'Error': 'Contact not found'})
+        return json_response({'Status': 'Success', 'Message': 'Contact deleted successfully'})
@@ -0,0 +1,121 @@
+import uuid
+from datetime import datetime, timezone
+
+import jwt
+from django.conf import settings
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+from .models import User, RevokedToken
+
+
+class TokenUser:
+    """
+    User built from the claims of a signed access token, so authenticated
+    requests need no database lookup. Views only rely on id, email, type and
+    the is_* flags; use `get_user()` when the full model is needed.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, payload):
+        self.id = self.pk = payload['user_id']
+        self.email = payload.get('email', '')
+        self.type = payload.get('user_type')
+        self.is_active = True
+        self.is_staff = payload.get('is_staff', False)
+        self.is_superuser = payload.get('is_superuser', False)
+
+    def __str__(self):
+        return self.email
+
+    def get_user(self):
+        return User.objects.get(id=self.id)
+
+
+def encode_token(user, token_type, lifetime):
+    now = datetime.now(tz=timezone.utc)
+    payload = {
+        'token_type': token_type,
+        'jti': uuid.uuid4().hex,
+        'user_id': user.id,
+        'iat': now,
+        'exp': now + lifetime,
+    }
+    if token_type == 'access':
+        payload.update(email=user.email, user_type=user.type, is_staff=user.is_staff, is_superuser=user.is_superuser)
+    config = settings.SIGNED_TOKENS
+    return jwt.encode(payload, config['SIGNING_KEY'], algorithm=config['ALGORITHM'])
+
+
+def decode_token(token, token_type):
+    config = settings.SIGNED_TOKENS
+    try:
+        payload = jwt.decode(
+            token, config['SIGNING_KEY'], algorithms=[config['ALGORITHM']],
+            options={'require': ['exp', 'jti', 'user_id', 'token_type']}
+        )
+    except jwt.ExpiredSignatureError:
+        raise exceptions.AuthenticationFailed('Token has expired.')
+    except jwt.InvalidTokenError:
+        raise exceptions.AuthenticationFailed('Invalid token.')
+    if payload['token_type'] != token_type:
+        raise exceptions.AuthenticationFailed('Invalid token type.')
+    return payload
+
+
+def issue_tokens(user):
+    config = settings.SIGNED_TOKENS
+    return {
+        'access': encode_token(user, 'access', config['ACCESS_LIFETIME']),
+        'refresh': encode_token(user, 'refresh', config['REFRESH_LIFETIME']),
+    }
+
+
+def revoke_token(payload):
+    """Revoke a token; returns False if it had already been revoked."""
+    expires_at = datetime.fromtimestamp(payload['exp'], tz=timezone.utc)
+    RevokedToken.objects.filter(expires_at__lt=datetime.now(tz=timezone.utc)).delete()
+    # get_or_create falls back to a lookup on IntegrityError, so of two
+    # concurrent calls exactly one inserts the jti
+    _, created = RevokedToken.objects.get_or_create(jti=payload['jti'], defaults={'expires_at': expires_at})
+    return created
+
+
+def refresh_tokens(refresh):
+    """Rotate a refresh token: the old one is revoked, a new access/refresh pair is issued."""
+    payload = decode_token(refresh, 'refresh')
+    # revoking is the check: a token refreshed concurrently is used only once
+    if not revoke_token(payload):
+        raise exceptions.AuthenticationFailed('Token has been revoked.')
+    try:
+        user = User.objects.get(id=payload['user_id'], is_active=True)
+    except User.DoesNotExist:
+        raise exceptions.AuthenticationFailed('User inactive or deleted.')
+    return issue_tokens(user)
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """
+    Stateless authentication with short-lived signed access tokens:
+
+        Authorization: Bearer <access token>
+    """
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+
+        try:
+            token = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+        payload = decode_token(token, 'access')
+        return TokenUser(payload), payload
+
+    def authenticate_header(self, request):
+        return self.keyword
@@ -0,0 +1,108 @@
+import statistics
+import time
+import tracemalloc
+
+import yaml
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext
+
+from .importer import PriceListImporter
+from .models import Shop
+
+
+def price_list_goods(products, parameters, categories=10, offset=0):
+    """Items of a synthetic price list, in the layout PriceListImporter expects."""
+    for i in range(products):
+        yield {
+            'id': i,
+            'category': i % categories + 1,
+            'model': f'model-{i}',
+            'name': f'Product {i}',
+            'price': 100 + (i + offset) % 900,
+            'price_rrc': 1000 + (i + offset) % 900,
+            'quantity': (i + offset) % 20,
+            'parameters': {f'Parameter {k}': str((i + k) % 10) for k in range(parameters)},
+        }
+
+
+def price_list(shop, products, parameters, categories=10, offset=0):
+    return {
+        'shop': shop,
+        'categories': [{'id': i + 1, 'name': f'Category {i + 1}'} for i in range(categories)],
+        'goods': list(price_list_goods(products, parameters, categories, offset)),
+    }
+
+
+def write_price_list(stream, shop, products, parameters, categories=10, offset=0):
+    """Write a price list as YAML item by item, so its size is not bounded by memory."""
+    header = price_list(shop, 0, parameters, categories)
+    del header['goods']
+    stream.write(yaml.safe_dump(header, sort_keys=False, allow_unicode=True))
+    stream.write('goods:\n')
+    for item in price_list_goods(products, parameters, categories, offset):
+        stream.write(yaml.safe_dump([item], sort_keys=False, allow_unicode=True))
+
+
+def generate_catalog(shops, products, parameters, categories=10):
+    """
+    Import `shops` price lists of the same `products` with `parameters` each,
+    so every product gets one offer per shop.
+    """
+    for i in range(shops):
+        shop = Shop.objects.create(name=f'Shop {i}', url=f'https://shop{i}.example.com')
+        PriceListImporter(shop).run(price_list(shop.name, products, parameters, categories, offset=i))
+
+
+def percentile(timings, percent):
+    if len(timings) == 1:
+        return timings[0]
+    return statistics.quantiles(timings, n=100, method='inclusive')[percent - 1]
+
+
+def measure(request, repeats):
+    """
+    Call `request()` (which returns a response) `repeats` times and report
+    query count, latency percentiles in ms and the peak Python memory of one
+    extra traced call, which is kept out of the timings.
+    """
+    timings = []
+    for _ in range(repeats):
+        # the query log is a bounded deque: keep it from saturating
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = request()
+            timings.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    try:
+        request()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'status': response.status_code,
+        'requests': repeats,
+        'queries': len(queries),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p90_ms': round(percentile(timings, 90), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def compare(previous, current):
+    """Relative change of the headline numbers of two result documents, per scenario."""
+    changes = {}
+    for name, result in current['results'].items():
+        before = previous.get('results', {}).get(name)
+        if not before:
+            continue
+        changes[name] = {
+            key: round((result[key] - before[key]) / before[key] * 100, 1) if before[key] else None
+            for key in ('queries', 'p50_ms', 'p99_ms', 'peak_memory_kb', 'rows_per_second')
+            if key in result and key in before
+        }
+    return changes
@@ -0,0 +1,125 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .routers import apin_if_catalog_changed, catalog_changed, pin_if_catalog_changed
+
+
+CATALOG_VERSION_KEY = 'catalog:version'
+# bumped by changes that are not tied to shops (products, categories, parameters)
+CATALOG_SHARED_VERSION_KEY = f'{CATALOG_VERSION_KEY}:shared'
+CATALOG_HITS_KEY = 'catalog:hits'
+CATALOG_MISSES_KEY = 'catalog:misses'
+
+
+def get_cache():
+    return caches[settings.CATALOG_CACHE]
+
+
+def initial_value(key):
+    # start versions from a timestamp so an evicted counter never reuses old values
+    return int(time.time() * 1000) if key.startswith(CATALOG_VERSION_KEY) else 0
+
+
+def incr(key, delta=1):
+    cache = get_cache()
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        cache.add(key, initial_value(key), None)
+        return cache.incr(key, delta)
+
+
+async def aincr(key, delta=1):
+    cache = get_cache()
+    try:
+        return await cache.aincr(key, delta)
+    except ValueError:
+        await cache.aadd(key, initial_value(key), None)
+        return await cache.aincr(key, delta)
+
+
+def version_key(shop_id=None):
+    return CATALOG_VERSION_KEY if shop_id is None else f'{CATALOG_VERSION_KEY}:{shop_id}'
+
+
+def catalog_version_keys(shop_ids=None):
+    keys = [version_key(shop_id) for shop_id in sorted(set(shop_ids or []))]
+    return [CATALOG_SHARED_VERSION_KEY, *keys] if keys else [version_key()]
+
+
+def get_catalog_version(shop_ids=None):
+    """
+    Version of the catalog as seen by a request: the versions of the given
+    shops plus the shared version, or the global version when the request is
+    not limited to shops.
+    """
+    keys = catalog_version_keys(shop_ids)
+    versions = get_cache().get_many(keys)
+    for key in keys:
+        if key not in versions:
+            versions[key] = incr(key, 0)
+    return '.'.join(str(versions[key]) for key in keys)
+
+
+async def aget_catalog_version(shop_ids=None):
+    keys = catalog_version_keys(shop_ids)
+    versions = await get_cache().aget_many(keys)
+    for key in keys:
+        if key not in versions:
+            versions[key] = await aincr(key, 0)
+    return '.'.join(str(versions[key]) for key in keys)
+
+
+def bump_catalog_version(*shop_ids):
+    """
+    Invalidate cached catalog responses of the given shops, or of all shops
+    when none are given.
+    """
+    for shop_id in set(shop_ids):
+        incr(version_key(shop_id))
+    if not shop_ids:
+        incr(CATALOG_SHARED_VERSION_KEY)
+    incr(version_key())
+    catalog_changed()
+
+
+def catalog_cache_key(request):
+    query = '&'.join(
+        f'{key}={value}' for key, values in sorted(request.query_params.lists()) for value in sorted(values)
+    )
+    digest = hashlib.md5(f'{request.get_host()}{request.path}?{query}'.encode('utf-8')).hexdigest()
+    return f'catalog:response:{digest}'
+
+
+def get_cached_catalog(request, shop_ids=None):
+    version = get_catalog_version(shop_ids)
+    data = get_cache().get(catalog_cache_key(request), version=version)
+    incr(CATALOG_MISSES_KEY if data is None else CATALOG_HITS_KEY)
+    if data is None:
+        pin_if_catalog_changed()
+    return data, version
+
+
+def set_cached_catalog(request, data, version):
+    get_cache().set(catalog_cache_key(request), data, settings.CATALOG_CACHE_TIMEOUT, version=version)
+
+
+async def aget_cached_catalog(request, shop_ids=None):
+    version = await aget_catalog_version(shop_ids)
+    data = await get_cache().aget(catalog_cache_key(request), version=version)
+    await aincr(CATALOG_MISSES_KEY if data is None else CATALOG_HITS_KEY)
+    if data is None:
+        await apin_if_catalog_changed()
+    return data, version
+
+
+async def aset_cached_catalog(request, data, version):
+    await get_cache().aset(catalog_cache_key(request), data, settings.CATALOG_CACHE_TIMEOUT, version=version)
+
+
+def catalog_cache_stats():
+    counters = get_cache().get_many([CATALOG_HITS_KEY, CATALOG_MISSES_KEY])
+    return {'hits': counters.get(CATALOG_HITS_KEY, 0), 'misses': counters.get(CATALOG_MISSES_KEY, 0)}
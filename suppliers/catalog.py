@@ -0,0 +1,203 @@
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.db import connection
+from django.db.models import Count, F, Max, Q, Sum, Window
+from django.db.models.functions import DenseRank, FirstValue
+
+from .models import Shop, Product, ProductInfo, Parameter, ProductParameter, CatalogOffer
+
+
+TABLES = {
+    'catalog': CatalogOffer._meta.db_table,
+    'product_info': ProductInfo._meta.db_table,
+    'product': Product._meta.db_table,
+    'shop': Shop._meta.db_table,
+    'parameter': Parameter._meta.db_table,
+    'product_parameter': ProductParameter._meta.db_table,
+}
+
+PARAMETERS_SQL = '''
+    COALESCE((
+        SELECT jsonb_object_agg(parameter.name, product_parameter.value)
+        FROM {product_parameter} product_parameter
+        JOIN {parameter} parameter ON parameter.id = product_parameter.parameter_id
+        WHERE product_parameter.product_info_id = info.id
+    ), '{{}}'::jsonb)
+'''
+
+REFRESH_SQL = '''
+    INSERT INTO {catalog} (
+        offer_id, product_id, product_name, category_id, shop_id, shop_name, shop_state,
+        name, model, price, price_rrp, quantity, parameters
+    )
+    SELECT info.id, product.id, product.name, product.category_id, shop.id, shop.name, shop.state,
+           info.name, info.model, info.price, info.price_rrp, info.quantity, {parameters}
+    FROM {product_info} info
+    JOIN {product} product ON product.id = info.product_id
+    JOIN {shop} shop ON shop.id = info.shop_id
+    WHERE info.id IN ({offers})
+'''
+
+
+def parameters_in_json():
+    return settings.PRODUCT_PARAMETER_STORAGE == 'json'
+
+
+def refresh_catalog(offers):
+    """Rebuild the CatalogOffer rows of the given ProductInfo queryset."""
+    try:
+        sql, params = offers.order_by().values('id').query.sql_with_params()
+    except EmptyResultSet:
+        # e.g. `id__in=[]`
+        return
+    parameters = 'info.parameters' if parameters_in_json() else PARAMETERS_SQL.format(**TABLES)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLES["catalog"]} WHERE offer_id IN ({sql})', params)
+        cursor.execute(REFRESH_SQL.format(offers=sql, parameters=parameters, **TABLES), params)
+
+
+def copy_parameters_to_json(offers):
+    """Store the ProductParameter rows of `offers` in their ProductInfo.parameters documents."""
+    sql, params = offers.order_by().values('id').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {TABLES["product_info"]} info SET parameters = {PARAMETERS_SQL.format(**TABLES)} '
+            f'WHERE info.id IN ({sql})',
+            params
+        )
+        return cursor.rowcount
+
+
+def catalog_offers(catalog):
+    """CatalogOffer rows matching a CatalogFilter."""
+    offers = CatalogOffer.objects.all()
+    if catalog.categories:
+        offers = offers.filter(category_id__in=catalog.categories)
+    if catalog.shops:
+        offers = offers.filter(shop_id__in=catalog.shops)
+    if catalog.price_min is not None:
+        offers = offers.filter(price__gte=catalog.price_min)
+    if catalog.price_max is not None:
+        offers = offers.filter(price__lte=catalog.price_max)
+    if catalog.in_stock:
+        offers = offers.filter(quantity__gt=0)
+    if not catalog.include_unavailable:
+        offers = offers.filter(shop_state=True, quantity__gt=0)
+    if catalog.parameters:
+        offers = offers.filter(parameters__contains=dict(catalog.parameters))
+    return offers
+
+
+def catalog_page_offers(catalog, position, limit):
+    """
+    Offers of up to `limit` products after `position` (name, id) in
+    (-name, -id) order, fetched with a single scan of the read model.
+    """
+    offers = catalog_offers(catalog)
+    if position is not None:
+        name, pk = position
+        offers = offers.filter(Q(product_name__lt=name) | Q(product_id__lt=pk), product_name__lte=name)
+    return offers.annotate(
+        rank=Window(DenseRank(), order_by=[F('product_name').desc(), F('product_id').desc()])
+    ).filter(rank__lte=limit).order_by('-product_name', '-product_id', 'offer_id').values(
+        'product_id', 'product_name', 'shop_name', 'name', 'price', 'quantity', 'parameters'
+    )
+
+
+def group_catalog_offers(offers):
+    """Group ordered read model rows into products in the ProductSerializer layout."""
+    products = []
+    for offer in offers:
+        if not products or products[-1]['id'] != offer['product_id']:
+            products.append({'id': offer['product_id'], 'name': offer['product_name'], 'product_info': []})
+        products[-1]['product_info'].append({
+            'name': offer['name'],
+            'shop': offer['shop_name'],
+            'product_parameters': [
+                {'parameter': parameter, 'value': value} for parameter, value in offer['parameters'].items()
+            ],
+            'price': offer['price'],
+            'quantity': offer['quantity'],
+        })
+    return products
+
+
+def catalog_page(catalog, position, limit):
+    return group_catalog_offers(catalog_page_offers(catalog, position, limit))
+
+
+def catalog_products(products, offers):
+    """
+    Serialize a page of Product instances with their `offers` (a ProductInfo
+    queryset) into the ProductSerializer layout, straight from values() rows.
+    """
+    in_json = parameters_in_json()
+    product_offers = {product.id: [] for product in products}
+    offer_rows = offers.filter(product_id__in=product_offers).order_by('id').values(
+        'id', 'product_id', 'name', 'shop__name', 'price', 'quantity', *(['parameters'] if in_json else [])
+    )
+    parameters = {}
+    for offer in offer_rows:
+        parameters[offer['id']] = [
+            {'parameter': name, 'value': value} for name, value in offer['parameters'].items()
+        ] if in_json else []
+        product_offers[offer['product_id']].append({
+            'name': offer['name'],
+            'shop': offer['shop__name'],
+            'product_parameters': parameters[offer['id']],
+            'price': offer['price'],
+            'quantity': offer['quantity'],
+        })
+
+    if parameters and not in_json:
+        parameter_rows = ProductParameter.objects.filter(product_info_id__in=parameters).values_list(
+            'product_info_id', 'parameter__name', 'value'
+        )
+        for offer_id, name, value in parameter_rows:
+            parameters[offer_id].append({'parameter': name, 'value': value})
+
+    return [{'name': product.name, 'product_info': product_offers[product.id]} for product in products]
+
+
+def compare_offers(products, offers):
+    """
+    Cross-shop comparison for a page of Product instances: the cheapest of
+    their `offers` (a ProductInfo queryset) with its shop and the discount
+    against its recommended price, the best-stocked shop and the stock of all
+    shops. One DISTINCT ON query, the (product, price) index yields each
+    product's offers cheapest first.
+    """
+    by_product = {'partition_by': F('product_id')}
+    rows = offers.filter(product_id__in=[product.id for product in products]).annotate(
+        offer_count=Window(Count('id'), **by_product),
+        total_quantity=Window(Sum('quantity'), **by_product),
+        max_price=Window(Max('price'), **by_product),
+        stocked_shop=Window(
+            FirstValue('shop__name'), order_by=[F('quantity').desc(), F('price'), F('id')], **by_product
+        ),
+        stocked_quantity=Window(
+            FirstValue('quantity'), order_by=[F('quantity').desc(), F('price'), F('id')], **by_product
+        ),
+    ).order_by('product_id', 'price', 'id').distinct('product_id').values(
+        'product_id', 'price', 'price_rrp', 'shop__name', 'offer_count', 'total_quantity', 'max_price',
+        'stocked_shop', 'stocked_quantity'
+    )
+    best = {row['product_id']: row for row in rows}
+
+    return [
+        {
+            'name': product.name,
+            'offers': row['offer_count'],
+            'min_price': row['price'],
+            'max_price': row['max_price'],
+            'shop': row['shop__name'],
+            'price_rrp': row['price_rrp'],
+            'discount': row['price_rrp'] - row['price'],
+            'discount_percent': (
+                round((row['price_rrp'] - row['price']) / row['price_rrp'] * 100, 1) if row['price_rrp'] else None
+            ),
+            'total_quantity': row['total_quantity'],
+            'best_stocked': {'shop': row['stocked_shop'], 'quantity': row['stocked_quantity']},
+        }
+        for product in products if (row := best.get(product.id))
+    ]
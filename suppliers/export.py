@@ -0,0 +1,97 @@
+import csv
+import io
+import json
+
+import orjson
+import yaml
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from .catalog import TABLES, PARAMETERS_SQL, parameters_in_json
+from .models import Category
+
+
+EXPORT_SQL = '''
+    SELECT info.external_id, product.category_id, info.model, info.name,
+           info.price, info.price_rrp, info.quantity, {parameters}
+    FROM {product_info} info
+    JOIN {product} product ON product.id = info.product_id
+    WHERE info.shop_id = %s
+    ORDER BY info.external_id
+'''
+
+CSV_FIELDS = ('id', 'category', 'model', 'name', 'price', 'price_rrc', 'quantity', 'parameters')
+
+
+def export_offers(shop_id, using=DEFAULT_DB_ALIAS):
+    """
+    Offers of a shop as lists of price list items, read through a server-side
+    cursor EXPORT_CHUNK_SIZE rows at a time, so memory does not grow with the
+    size of the shop.
+    """
+    parameters = 'info.parameters' if parameters_in_json() else PARAMETERS_SQL.format(**TABLES)
+    # inside a transaction the cursor is not WITH HOLD, which would make
+    # Postgres materialize the whole result before the first fetch
+    with transaction.atomic(using=using), connections[using].chunked_cursor() as cursor:
+        cursor.execute(EXPORT_SQL.format(parameters=parameters, **TABLES), [shop_id])
+        while rows := cursor.fetchmany(settings.EXPORT_CHUNK_SIZE):
+            yield [
+                {
+                    'id': external_id,
+                    'category': category,
+                    'model': model,
+                    'name': name,
+                    'price': price,
+                    'price_rrc': price_rrp,
+                    'quantity': quantity,
+                    'parameters': json.loads(parameters),
+                }
+                for external_id, category, model, name, price, price_rrp, quantity, parameters in rows
+            ]
+
+
+def export_csv(shop, using=DEFAULT_DB_ALIAS):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_FIELDS)
+    for items in export_offers(shop.id, using):
+        for item in items:
+            writer.writerow([
+                orjson.dumps(item[field]).decode() if field == 'parameters' else item[field]
+                for field in CSV_FIELDS
+            ])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def export_jsonl(shop, using=DEFAULT_DB_ALIAS):
+    for items in export_offers(shop.id, using):
+        yield b''.join(orjson.dumps(item) + b'\n' for item in items)
+
+
+def export_yaml(shop, using=DEFAULT_DB_ALIAS):
+    """The price list of a shop in the format YAMLLoadView accepts."""
+    header = {
+        'shop': shop.name,
+        'categories': list(
+            Category.objects.using(using).filter(shops=shop.id).order_by('id').values('id', 'name')
+        ),
+    }
+    yield yaml.safe_dump(header, sort_keys=False, allow_unicode=True).encode() + b'goods:'
+    empty = True
+    for items in export_offers(shop.id, using):
+        chunk = yaml.safe_dump(items, sort_keys=False, allow_unicode=True).encode()
+        yield b'\n' + chunk if empty else chunk
+        empty = False
+    if empty:
+        yield b' []\n'
+
+
+EXPORT_FORMATS = {
+    'csv': (export_csv, 'text/csv'),
+    'jsonl': (export_jsonl, 'application/jsonl'),
+    'yaml': (export_yaml, 'text/yaml'),
+}
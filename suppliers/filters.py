@@ -0,0 +1,151 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+from django.db import connections
+from django.db.models import Count, Exists, FloatField, OuterRef, Q
+from django.db.models.functions import Cast
+from rest_framework.exceptions import ValidationError
+
+from .catalog import parameters_in_json
+from .models import SEARCH_CONFIG, Product, ProductInfo, ProductParameter
+
+
+class CatalogFilter:
+    """
+    Server-side catalog filters taken from the query string:
+
+        category=<id>         (repeatable)
+        shop=<id>             (repeatable)
+        price_min=<int>, price_max=<int>
+        in_stock=true         offers with quantity > 0
+        parameter=<name>:<value>  (repeatable, all must match)
+        include_unavailable=true  also offers of inactive shops and sold-out offers
+        facets=false          skip facet counts
+
+    Products are kept when at least one of their offers matches, and only
+    the matching offers are returned for them. Unless include_unavailable is
+    given, offers of inactive shops and offers with quantity 0 never match.
+    """
+    facet_limit = 100
+
+    def __init__(self, query_params):
+        self.categories = self.get_ids(query_params, 'category')
+        self.shops = self.get_ids(query_params, 'shop')
+        self.price_min = self.get_int(query_params, 'price_min')
+        self.price_max = self.get_int(query_params, 'price_max')
+        self.in_stock = query_params.get('in_stock', '').lower() in ('1', 'true', 'yes')
+        self.include_unavailable = query_params.get('include_unavailable', '').lower() in ('1', 'true', 'yes')
+        self.parameters = []
+        for parameter in query_params.getlist('parameter'):
+            name, separator, value = parameter.partition(':')
+            if not separator or not name:
+                raise ValidationError({'parameter': 'Expected <name>:<value>'})
+            self.parameters.append((name, value))
+        self.with_facets = query_params.get('facets', '').lower() not in ('0', 'false', 'no')
+
+    @staticmethod
+    def get_ids(query_params, key):
+        try:
+            return [int(value) for value in query_params.getlist(key)]
+        except ValueError:
+            raise ValidationError({key: 'Expected integer ids'})
+
+    @staticmethod
+    def get_int(query_params, key):
+        value = query_params.get(key)
+        if value in (None, ''):
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise ValidationError({key: 'Expected an integer'})
+
+    @property
+    def filters_offers(self):
+        return bool(self.shops or self.parameters or self.in_stock or not self.include_unavailable
+                    or self.price_min is not None or self.price_max is not None)
+
+    def offers(self):
+        offers = ProductInfo.objects.all()
+        if self.shops:
+            offers = offers.filter(shop_id__in=self.shops)
+        if self.price_min is not None:
+            offers = offers.filter(price__gte=self.price_min)
+        if self.price_max is not None:
+            offers = offers.filter(price__lte=self.price_max)
+        if self.in_stock:
+            offers = offers.filter(quantity__gt=0)
+        if not self.include_unavailable:
+            offers = offers.filter(shop__state=True, quantity__gt=0)
+        if self.parameters and parameters_in_json():
+            offers = offers.filter(parameters__contains=dict(self.parameters))
+        elif self.parameters:
+            for name, value in self.parameters:
+                offers = offers.filter(Exists(ProductParameter.objects.filter(
+                    product_info_id=OuterRef('pk'), parameter__name=name, value=value
+                )))
+        return offers
+
+    def products(self):
+        products = Product.objects.all()
+        if self.categories:
+            products = products.filter(category_id__in=self.categories)
+        if self.filters_offers:
+            products = products.filter(Exists(self.offers().filter(product_id=OuterRef('pk'))))
+        return products
+
+    def facets(self):
+        products = self.products()
+        offers = self.offers().filter(product__in=products.values('id'))
+        categories = products.order_by().values('category_id', 'category__name').annotate(count=Count('id'))
+        shops = offers.order_by().values('shop_id', 'shop__name').annotate(count=Count('id'))
+        if parameters_in_json():
+            parameters = self.json_parameter_facets(offers)
+        else:
+            parameters = ProductParameter.objects.filter(product_info__in=offers.values('id')).order_by().values(
+                'parameter__name', 'value'
+            ).annotate(count=Count('id')).order_by('-count', 'parameter__name', 'value')[:self.facet_limit]
+
+        return {
+            'categories': [
+                {'id': row['category_id'], 'name': row['category__name'], 'count': row['count']}
+                for row in categories.order_by('-count', 'category__name')
+            ],
+            'shops': [
+                {'id': row['shop_id'], 'name': row['shop__name'], 'count': row['count']}
+                for row in shops.order_by('-count', 'shop__name')
+            ],
+            'parameters': [
+                {'parameter': row['parameter__name'], 'value': row['value'], 'count': row['count']}
+                for row in parameters
+            ],
+        }
+
+    def json_parameter_facets(self, offers):
+        offers = offers.order_by().values('parameters')
+        sql, params = offers.query.sql_with_params()
+        with connections[offers.db].cursor() as cursor:
+            cursor.execute(
+                f'''
+                SELECT entry.key, entry.value, COUNT(*) AS count
+                FROM ({sql}) offer, jsonb_each_text(offer.parameters) entry
+                GROUP BY entry.key, entry.value
+                ORDER BY count DESC, entry.key, entry.value
+                LIMIT %s
+                ''',
+                [*params, self.facet_limit]
+            )
+            return [{'parameter__name': name, 'value': value, 'count': count} for name, value, count in cursor]
+
+
+def search_products(products, text):
+    """
+    Products whose name matches `text`, either by full-text search or by
+    trigram word similarity (which tolerates misspellings), annotated with a
+    `rank` combining both. The two conditions are served by the GIN indexes
+    of Product.
+    """
+    query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+    vector = SearchVector('name', config=SEARCH_CONFIG)
+    return products.annotate(
+        search=vector,
+        rank=Cast(SearchRank(vector, query) + TrigramWordSimilarity(text, 'name'), FloatField()),
+    ).filter(Q(search=query) | Q(name__trigram_word_similar=text))
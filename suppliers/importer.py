@@ -0,0 +1,376 @@
+import time
+
+from django.db import connection, transaction
+
+from .cache import bump_catalog_version
+from .catalog import TABLES, refresh_catalog, parameters_in_json
+from .models import Category, Product, ProductInfo, Parameter, ProductParameter, CatalogOffer, OrderItem
+
+
+REQUIRED_ITEM_FIELDS = ('id', 'category', 'name', 'price', 'price_rrc', 'quantity')
+OFFER_FIELDS = ('product_id', 'model', 'name', 'price', 'price_rrp', 'quantity')
+
+# One statement: update the changed offers and their read model rows, then
+# report which of the patched external ids the shop does not have. A missing
+# price or quantity (NULL) keeps the current value.
+PATCH_OFFERS_SQL = '''
+    WITH patch AS (
+        SELECT * FROM unnest(%(external_ids)s::bigint[], %(prices)s::int[], %(quantities)s::int[])
+            AS patch (external_id, price, quantity)
+    ), updated AS (
+        UPDATE {product_info} info
+        SET price = COALESCE(patch.price, info.price), quantity = COALESCE(patch.quantity, info.quantity)
+        FROM patch
+        WHERE info.shop_id = %(shop_id)s AND info.external_id = patch.external_id
+          AND (info.price, info.quantity) IS DISTINCT FROM
+              (COALESCE(patch.price, info.price), COALESCE(patch.quantity, info.quantity))
+        RETURNING info.id, info.price, info.quantity
+    ), catalog AS (
+        UPDATE {catalog} catalog SET price = updated.price, quantity = updated.quantity
+        FROM updated WHERE catalog.offer_id = updated.id
+    )
+    SELECT (SELECT count(*) FROM updated), ARRAY(
+        SELECT patch.external_id FROM patch WHERE NOT EXISTS (
+            SELECT 1 FROM {product_info} info
+            WHERE info.shop_id = %(shop_id)s AND info.external_id = patch.external_id
+        ) ORDER BY patch.external_id
+    )
+'''
+
+DELETE_OFFERS_SQL = 'DELETE FROM {product_info} WHERE id = ANY(%s)'
+
+
+class PriceListImporter:
+    """
+    Set-based loader for seller price lists.
+
+    Categories, products and parameters are resolved through name -> id maps
+    that are preloaded once per batch, so an import costs a fixed number of
+    queries per batch instead of several queries per item. Offers are matched
+    on (shop, external_id): a re-upload only writes the rows that changed and
+    zeroes (or deletes, with missing='delete') offers it no longer lists.
+    """
+    batch_size = 1000
+    max_errors = 100
+    missing = 'zero'
+
+    def __init__(self, shop, batch_size=None, on_batch=None, missing=None):
+        self.shop = shop
+        if batch_size:
+            self.batch_size = batch_size
+        if missing:
+            self.missing = missing
+        self.on_batch = on_batch
+        self.json_parameters = parameters_in_json()
+        self.seen = set()
+        self.products = {}
+        self.parameters = {}
+        self.new_products = []
+        self.new_parameters = []
+        self.stats = {
+            'categories': 0, 'products': 0, 'parameters': 0,
+            'offers': 0, 'offers_created': 0, 'offers_updated': 0, 'offers_missing': 0,
+            'product_parameters': 0, 'product_parameters_removed': 0,
+        }
+        self.errors = []
+        self.error_count = 0
+        self.started = None
+        # set when the price list could not be read to the end
+        self.aborted = False
+
+    def run(self, data):
+        """Import the whole price list in a single transaction."""
+        self.started = time.monotonic()
+        with transaction.atomic():
+            self.import_categories(data.get('categories', []))
+            for batch in self.batches(data.get('goods', [])):
+                self.import_batch(batch)
+                self.batch_done()
+            self.sweep_missing()
+            transaction.on_commit(lambda: bump_catalog_version(self.shop.id))
+        return self.summary()
+
+    def run_batches(self, data):
+        """
+        Import the price list committing every batch separately. A failing
+        batch is rolled back and reported, the following batches still run.
+        """
+        self.started = time.monotonic()
+        with transaction.atomic():
+            self.import_categories(data.get('categories', []))
+        try:
+            for number, batch in enumerate(self.batches(data.get('goods', []))):
+                try:
+                    with transaction.atomic():
+                        self.import_batch(batch)
+                except Exception as e:
+                    self.forget_batch()
+                    self.add_error({'batch': number, 'items': len(batch), 'error': str(e)})
+                self.batch_done()
+        except Exception as e:
+            self.aborted = True
+            self.add_error({'error': str(e)})
+        else:
+            with transaction.atomic():
+                self.sweep_missing()
+        bump_catalog_version(self.shop.id)
+        return self.summary()
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started if self.started else 0
+        return {
+            **self.stats,
+            'seconds': round(elapsed, 3),
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+    def batch_done(self):
+        if self.on_batch:
+            self.on_batch(self)
+
+    def add_error(self, error):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(error)
+
+    def batches(self, goods):
+        batch = []
+        for item in goods:
+            try:
+                external_id = int(item['id'])
+            except (KeyError, TypeError, ValueError):
+                self.add_error({'id': item.get('id'), 'error': 'Missing or invalid id'})
+                continue
+            if external_id in self.seen:
+                self.add_error({'id': external_id, 'error': 'Duplicate external id'})
+                continue
+            self.seen.add(external_id)
+
+            missing = [field for field in REQUIRED_ITEM_FIELDS if field not in item]
+            if missing:
+                self.add_error({'id': external_id, 'error': f'Missing fields: {", ".join(missing)}'})
+                continue
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def import_categories(self, categories):
+        categories = {int(category['id']): category['name'] for category in categories}
+        if not categories:
+            return
+
+        existing = set(Category.objects.filter(id__in=categories).values_list('id', flat=True))
+        new = [Category(id=pk, name=name) for pk, name in categories.items() if pk not in existing]
+        # another import may be creating the same categories right now
+        Category.objects.bulk_create(new, ignore_conflicts=True)
+        self.stats['categories'] += len(new)
+
+        through = Category.shops.through
+        through.objects.bulk_create(
+            [through(category_id=pk, shop_id=self.shop.id) for pk in categories],
+            ignore_conflicts=True
+        )
+
+    def offer_values(self, item):
+        values = {
+            'product_id': self.products[(item['name'], int(item['category']))],
+            'model': str(item.get('model', '')),
+            'name': item['name'],
+            'price': int(item['price']),
+            'price_rrp': int(item['price_rrc']),
+            'quantity': int(item['quantity']),
+        }
+        if self.json_parameters:
+            values['parameters'] = {str(name): str(value) for name, value in item.get('parameters', {}).items()}
+        return values
+
+    def import_batch(self, items):
+        """
+        Upsert a batch of offers keyed on (shop, external_id): new offers are
+        inserted, changed ones updated, unchanged rows are left alone.
+        """
+        self.new_products = []
+        self.new_parameters = []
+        self.resolve_products(items)
+        if not self.json_parameters:
+            self.resolve_parameters(items)
+
+        offers = {
+            offer.external_id: offer for offer in ProductInfo.objects.filter(
+                shop_id=self.shop.id, external_id__in=[int(item['id']) for item in items]
+            )
+        }
+        existing_ids = [offer.id for offer in offers.values()]
+
+        new_offers, changed_offers = [], []
+        for item in items:
+            values = self.offer_values(item)
+            offer = offers.get(int(item['id']))
+            if offer is None:
+                offer = ProductInfo(shop_id=self.shop.id, external_id=int(item['id']), **values)
+                offers[offer.external_id] = offer
+                new_offers.append(offer)
+            elif any(getattr(offer, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(offer, field, value)
+                changed_offers.append(offer)
+
+        ProductInfo.objects.bulk_create(new_offers)
+        ProductInfo.objects.bulk_update(
+            changed_offers, OFFER_FIELDS + ('parameters',) if self.json_parameters else OFFER_FIELDS
+        )
+
+        touched = {offer.id for offer in new_offers + changed_offers}
+        if not self.json_parameters:
+            touched |= self.import_parameters(items, offers, existing_ids)
+        if touched:
+            refresh_catalog(ProductInfo.objects.filter(id__in=touched))
+
+        self.stats['products'] += len(self.new_products)
+        self.stats['parameters'] += len(self.new_parameters)
+        self.stats['offers'] += len(items)
+        self.stats['offers_created'] += len(new_offers)
+        self.stats['offers_updated'] += len(changed_offers)
+
+    def import_parameters(self, items, offers, existing_ids):
+        """Diff ProductParameter rows of a batch, return the ids of offers whose parameters changed."""
+        current = {}
+        for product_parameter in ProductParameter.objects.filter(product_info_id__in=existing_ids):
+            current.setdefault(product_parameter.product_info_id, {})[product_parameter.parameter_id] = product_parameter
+
+        new_parameters, changed_parameters, removed_parameters = [], [], []
+        touched = set()
+        for item in items:
+            offer = offers[int(item['id'])]
+            stored = current.get(offer.id, {})
+            values = {self.parameters[name]: str(value) for name, value in item.get('parameters', {}).items()}
+            for parameter_id, value in values.items():
+                product_parameter = stored.get(parameter_id)
+                if product_parameter is None:
+                    new_parameters.append(
+                        ProductParameter(product_info_id=offer.id, parameter_id=parameter_id, value=value)
+                    )
+                    touched.add(offer.id)
+                elif product_parameter.value != value:
+                    product_parameter.value = value
+                    changed_parameters.append(product_parameter)
+                    touched.add(offer.id)
+            for parameter_id, product_parameter in stored.items():
+                if parameter_id not in values:
+                    removed_parameters.append(product_parameter.id)
+                    touched.add(offer.id)
+
+        ProductParameter.objects.bulk_create(new_parameters)
+        ProductParameter.objects.bulk_update(changed_parameters, ['value'])
+        if removed_parameters:
+            ProductParameter.objects.filter(id__in=removed_parameters).delete()
+
+        self.stats['product_parameters'] += len(new_parameters) + len(changed_parameters)
+        self.stats['product_parameters_removed'] += len(removed_parameters)
+        return touched
+
+    def sweep_missing(self):
+        """Zero out (or delete) the shop's offers that are absent from the price list."""
+        missing = [
+            pk for pk, external_id in ProductInfo.objects.filter(
+                shop_id=self.shop.id
+            ).values_list('id', 'external_id').iterator(chunk_size=self.batch_size)
+            if external_id not in self.seen
+        ]
+        for start in range(0, len(missing), self.batch_size):
+            ids = missing[start:start + self.batch_size]
+            chunk = ProductInfo.objects.filter(id__in=ids)
+            if self.missing == 'delete':
+                self.stats['offers_missing'] += self.delete_offers(ids)
+            else:
+                self.stats['offers_missing'] += chunk.filter(quantity__gt=0).update(quantity=0)
+                CatalogOffer.objects.filter(offer_id__in=ids, quantity__gt=0).update(quantity=0)
+
+    @staticmethod
+    def delete_offers(ids):
+        """
+        Delete offers with what the ORM cascade would do, but in one statement
+        per table: a queryset delete() loads every offer and sends post_delete,
+        one catalog version bump per row, while the import bumps it once.
+        """
+        OrderItem.objects.filter(product_info_id__in=ids).update(product_info=None)
+        ProductParameter.objects.filter(product_info_id__in=ids).delete()
+        CatalogOffer.objects.filter(offer_id__in=ids).delete()
+        with connection.cursor() as cursor:
+            cursor.execute(DELETE_OFFERS_SQL.format(**TABLES), [ids])
+            return cursor.rowcount
+
+    def forget_batch(self):
+        """Drop ids created by a batch that has been rolled back."""
+        for key in self.new_products:
+            self.products.pop(key, None)
+        for key in self.new_parameters:
+            self.parameters.pop(key, None)
+
+    def find_products(self, keys):
+        existing = Product.objects.filter(
+            name__in={name for name, _ in keys},
+            category_id__in={category_id for _, category_id in keys}
+        ).values_list('id', 'name', 'category_id')
+        for pk, name, category_id in existing:
+            if (name, category_id) in keys:
+                self.products[(name, category_id)] = pk
+
+    def resolve_products(self, items):
+        keys = {(item['name'], int(item['category'])) for item in items} - self.products.keys()
+        if not keys:
+            return
+
+        self.find_products(keys)
+        new = keys - self.products.keys()
+        if not new:
+            return
+        # (name, category) is unique: a product inserted concurrently by another
+        # import is skipped (after waiting for that import to commit) and read back.
+        Product.objects.bulk_create(
+            [Product(name=name, category_id=category_id) for name, category_id in new], ignore_conflicts=True
+        )
+        self.find_products(new)
+        self.new_products.extend(new)
+
+    def resolve_parameters(self, items):
+        names = {name for item in items for name in item.get('parameters', {})} - self.parameters.keys()
+        if not names:
+            return
+
+        for pk, name in Parameter.objects.filter(name__in=names).values_list('id', 'name'):
+            self.parameters[name] = pk
+
+        new = names - self.parameters.keys()
+        if not new:
+            return
+        # Names are unique: a name inserted concurrently by another import is
+        # skipped (after waiting for that import to commit) and read back below.
+        Parameter.objects.bulk_create([Parameter(name=name) for name in new], ignore_conflicts=True)
+        for pk, name in Parameter.objects.filter(name__in=new).values_list('id', 'name'):
+            self.parameters[name] = pk
+            self.new_parameters.append(name)
+
+
+def patch_offers(shop, items):
+    """
+    Set price and/or quantity of the offers of `shop` listed in `items`
+    ({external id: {'price': ..., 'quantity': ...}}) with a single set-based
+    UPDATE. Returns the number of changed offers and the unmatched external ids.
+    """
+    external_ids = list(items)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(PATCH_OFFERS_SQL.format(**TABLES), {
+            'shop_id': shop.id,
+            'external_ids': external_ids,
+            'prices': [items[external_id].get('price') for external_id in external_ids],
+            'quantities': [items[external_id].get('quantity') for external_id in external_ids],
+        })
+        updated, unmatched = cursor.fetchone()
+        if updated:
+            transaction.on_commit(lambda: bump_catalog_version(shop.id))
+    return updated, unmatched
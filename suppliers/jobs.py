@@ -0,0 +1,100 @@
+import time
+from datetime import timedelta
+
+import yaml
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .importer import PriceListImporter
+from .models import ImportJob, Shop
+from .parsers import PriceListStream
+
+
+def enqueue_import(user, stream, streaming=False):
+    """Store an uploaded price list and queue it for the import workers."""
+    job = ImportJob(user_id=user.id, streaming=streaming)
+    job.file.save(f'{user.id}-{timezone.now():%Y%m%d%H%M%S%f}.yaml', File(stream), save=False)
+    job.save()
+    return job
+
+
+def claim_job():
+    """
+    Take the oldest queued job, skipping the ones other workers have locked.
+    A running job whose heartbeat (refreshed with every batch) is older than
+    IMPORT_JOB_TIMEOUT seconds is assumed to belong to a dead worker and is
+    taken again: imports are upserts, so running one twice is safe.
+    """
+    stale = timezone.now() - timedelta(seconds=settings.IMPORT_JOB_TIMEOUT)
+    with transaction.atomic():
+        job = ImportJob.objects.select_for_update(skip_locked=True).filter(
+            Q(status='queued') | Q(status='running', heartbeat_at__lt=stale)
+        ).order_by('id').first()
+        if job is None:
+            return None
+        job.status = 'running'
+        job.started_at = job.heartbeat_at = timezone.now()
+        job.save(update_fields=['status', 'started_at', 'heartbeat_at'])
+    return job
+
+
+def report_progress(job, importer):
+    job.rows_processed = importer.stats['offers']
+    job.error_count = importer.error_count
+    job.errors = importer.errors
+    job.heartbeat_at = timezone.now()
+    ImportJob.objects.filter(pk=job.pk).update(
+        rows_processed=job.rows_processed, error_count=job.error_count, errors=job.errors,
+        heartbeat_at=job.heartbeat_at,
+    )
+
+
+def import_price_list(stream, user_id=None, streaming=True, on_batch=None):
+    """
+    Import the price list in `stream` into its shop, which is looked up by
+    name and owner, or by name alone without `user_id`. Returns the importer.
+    """
+    data = PriceListStream(stream) if streaming else yaml.safe_load(stream)
+    if user_id is None:
+        shop, created = Shop.objects.get_or_create(name=data['shop'])
+    else:
+        shop, created = Shop.objects.get_or_create(name=data['shop'], user_id=user_id)
+    importer = PriceListImporter(shop, on_batch=on_batch)
+    importer.run_batches(data)
+    return importer
+
+
+def run_job(job):
+    try:
+        with job.file.open('rb') as stream:
+            importer = import_price_list(
+                stream, job.user_id, job.streaming, on_batch=lambda importer: report_progress(job, importer)
+            )
+        job.summary = importer.summary()
+        report_progress(job, importer)
+        # batches read before the file turned out broken stay imported
+        job.status = 'failed' if importer.aborted else 'done'
+    except Exception as e:
+        job.status = 'failed'
+        job.errors = [*job.errors, {'error': str(e)}]
+        job.error_count += 1
+    job.finished_at = timezone.now()
+    job.save()
+    if job.status == 'done':
+        job.file.delete()
+    return job
+
+
+def work(once=False):
+    """Process queued jobs; with `once` stop as soon as the queue is empty."""
+    while True:
+        job = claim_job()
+        if job is not None:
+            run_job(job)
+        elif once:
+            return
+        else:
+            time.sleep(settings.IMPORT_WORKER_POLL_INTERVAL)
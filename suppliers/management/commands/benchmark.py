@@ -0,0 +1,143 @@
+import io
+import json
+import platform
+import subprocess
+import tempfile
+import time
+
+import django
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from suppliers.authentication import issue_tokens
+from suppliers.benchmark import generate_catalog, write_price_list, measure, compare
+from suppliers.jobs import work
+from suppliers.models import User, Contact, ImportJob
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark /products/, /load/, /login/ and /contact/ against a synthetic catalog '
+        'in a throwaway test database and write the results as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shops', type=int, default=3)
+        parser.add_argument('--products', type=int, default=1000, help='Products per shop')
+        parser.add_argument('--parameters', type=int, default=5, help='Parameters per offer')
+        parser.add_argument('--price-list', type=int, default=1000, help='Items of the price list sent to /load/')
+        parser.add_argument('--repeats', type=int, default=50, help='Requests per scenario')
+        parser.add_argument('--output', default='benchmark.json', help='Result file, "-" for stdout')
+        parser.add_argument('--compare', help='Earlier result file to print relative changes against')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(MEDIA_ROOT=tempfile.mkdtemp()):
+                results = self.run_scenarios(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        document = {
+            'commit': self.get_commit(),
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'settings': {
+                'CATALOG_READ_MODEL': settings.CATALOG_READ_MODEL,
+                'PRODUCT_PARAMETER_STORAGE': settings.PRODUCT_PARAMETER_STORAGE,
+            },
+            'catalog': {key: options[key] for key in ('shops', 'products', 'parameters', 'price_list')},
+            'results': results,
+        }
+        output = json.dumps(document, indent=2)
+        if options['output'] == '-':
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+        if options['compare']:
+            with open(options['compare']) as file:
+                changes = compare(json.load(file), document)
+            for name, change in changes.items():
+                self.stdout.write(f'{name}: ' + ', '.join(f'{key} {value:+}%' for key, value in change.items()
+                                                          if value is not None))
+
+    def run_scenarios(self, options):
+        repeats = options['repeats']
+        started = time.perf_counter()
+        generate_catalog(options['shops'], options['products'], options['parameters'])
+        self.stdout.write(f'Catalog generated in {time.perf_counter() - started:.1f}s')
+
+        buyer = User.objects.create_user('buyer@example.com', 'benchmark-password', 'John', 'Doe', type='buyer')
+        Contact.objects.create(
+            user=buyer, last_name='Doe', first_name='John', email=buyer.email,
+            city='Moscow', street='Tverskaya', phone='123'
+        )
+        seller = User.objects.create_user('seller@example.com', 'benchmark-password', 'Jane', 'Doe', type='seller')
+        seller_token = Token.objects.create(user=seller)
+        access = issue_tokens(buyer)['access']
+
+        price_list = io.StringIO()
+        write_price_list(price_list, 'Benchmark shop', options['price_list'], options['parameters'])
+        price_list = price_list.getvalue()
+
+        client = Client()
+        catalog_cache = caches[settings.CATALOG_CACHE]
+        products = reverse('products')
+
+        def uncached(path):
+            def request():
+                catalog_cache.clear()
+                return client.get(path)
+            return request
+
+        results = {
+            'products': measure(uncached(products), repeats),
+            'products_cached': measure(lambda: client.get(products), repeats),
+            'products_filtered': measure(
+                uncached(f'{products}?category=1&price_max=500&parameter=Parameter 0:1'), repeats
+            ),
+            'login': measure(lambda: client.post(
+                reverse('login'), {'email': buyer.email, 'password': 'benchmark-password'}
+            ), repeats),
+            'contact': measure(lambda: client.get(reverse('contact'), HTTP_AUTHORIZATION=f'Bearer {access}'), repeats),
+            'load': measure(lambda: client.post(
+                reverse('yaml load'), price_list, content_type='text/yaml',
+                HTTP_AUTHORIZATION=f'Token {seller_token.key}'
+            ), repeats),
+        }
+
+        # the jobs queued by the /load/ scenario
+        jobs = ImportJob.objects.count()
+        started = time.perf_counter()
+        work(once=True)
+        elapsed = time.perf_counter() - started
+        rows = sum(ImportJob.objects.filter(status='done').values_list('rows_processed', flat=True))
+        results['import'] = {
+            'jobs': jobs,
+            'failed': ImportJob.objects.exclude(status='done').count(),
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(rows / elapsed, 1) if elapsed else 0,
+        }
+        return results
+
+    @staticmethod
+    def get_commit():
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
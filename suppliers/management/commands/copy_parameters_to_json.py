@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from suppliers.catalog import copy_parameters_to_json
+from suppliers.models import ProductInfo
+
+
+class Command(BaseCommand):
+    help = 'Copy ProductParameter rows into ProductInfo.parameters documents'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shop', type=int, help='Only offers of this shop id')
+
+    def handle(self, *args, **options):
+        offers = ProductInfo.objects.all()
+        if options['shop']:
+            offers = offers.filter(shop_id=options['shop'])
+        updated = copy_parameters_to_json(offers)
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} offers'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from suppliers.notifications import work
+
+
+class Command(BaseCommand):
+    help = 'Send queued emails in batches over reused SMTP connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when no email is due')
+
+    def handle(self, *args, **options):
+        work(once=options['once'])
@@ -0,0 +1,35 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from suppliers.export import EXPORT_FORMATS
+from suppliers.models import Shop
+
+
+class Command(BaseCommand):
+    help = 'Stream all offers of a shop as a YAML price list (the /load/ format), CSV or JSON lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('shop', type=int, help='Shop id')
+        parser.add_argument('--format', dest='output_format', choices=EXPORT_FORMATS, default='yaml')
+        parser.add_argument('--output', default='-', help='Output file, "-" for stdout')
+
+    def handle(self, *args, **options):
+        try:
+            shop = Shop.objects.get(id=options['shop'])
+        except Shop.DoesNotExist:
+            raise CommandError(f'Shop {options["shop"]} does not exist')
+
+        export = EXPORT_FORMATS[options['output_format']][0]
+        if options['output'] == '-':
+            self.write(export(shop), sys.stdout.buffer)
+        else:
+            with open(options['output'], 'wb') as file:
+                self.write(export(shop), file)
+            self.stderr.write(f'Shop {shop.id} exported to {options["output"]}')
+
+    @staticmethod
+    def write(chunks, file):
+        for chunk in chunks:
+            file.write(chunk)
+        file.flush()
@@ -0,0 +1,82 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from suppliers.jobs import import_price_list
+from suppliers.parsers import PriceListStream
+
+
+def import_shop(paths):
+    """Import the price lists of one shop one after another; runs in a pool worker."""
+    results = []
+    for path in paths:
+        try:
+            with open(path, 'rb') as stream:
+                summary = import_price_list(stream).summary()
+            results.append({'file': str(path), **summary})
+        except Exception as e:
+            results.append({'file': str(path), 'offers': 0, 'error_count': 1, 'errors': [{'error': str(e)}]})
+    connections.close_all()
+    return results
+
+
+class Command(BaseCommand):
+    help = (
+        'Import every YAML price list of a directory with a pool of worker processes. '
+        'Files of the same shop go to the same worker, in name order.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+        parser.add_argument('--pattern', default='*.y*ml', help='File name pattern, *.yaml and *.yml by default')
+
+    def handle(self, *args, **options):
+        directory = Path(options['directory'])
+        if not directory.is_dir():
+            raise CommandError(f'{directory} is not a directory')
+
+        shops = {}
+        for path in sorted(directory.glob(options['pattern'])):
+            try:
+                with open(path, 'rb') as stream:
+                    shop = PriceListStream(stream)['shop']
+            except Exception as e:
+                self.stderr.write(f'{path}: skipped, {e}')
+                continue
+            shops.setdefault(shop, []).append(path)
+        if not shops:
+            raise CommandError(f'No price lists in {directory}')
+
+        # biggest shops first, so a long import does not start last
+        groups = sorted(shops.values(), key=lambda paths: -sum(path.stat().st_size for path in paths))
+        self.stdout.write(f'Importing {sum(map(len, groups))} files of {len(groups)} shops')
+
+        # the workers are forked, whatever the platform default, so they inherit
+        # the configured Django; they must not share the parent's connections
+        connections.close_all()
+        rows = errors = 0
+        started = time.monotonic()
+        with ProcessPoolExecutor(
+            max_workers=max(1, min(options['workers'], len(groups))), mp_context=multiprocessing.get_context('fork')
+        ) as executor:
+            for future in as_completed([executor.submit(import_shop, paths) for paths in groups]):
+                for result in future.result():
+                    rows += result['offers']
+                    errors += result['error_count']
+                    self.stdout.write(
+                        f'{result["file"]}: {result["offers"]} offers in {result.get("seconds", 0)}s'
+                        + (f', {result["error_count"]} errors' if result['error_count'] else '')
+                    )
+                    for error in result['errors'][:5]:
+                        self.stderr.write(f'  {error}')
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{rows} offers in {elapsed:.1f}s, {rows / elapsed if elapsed else 0:.0f} rows/sec, {errors} errors'
+        ))
@@ -0,0 +1,31 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from suppliers.jobs import work
+
+
+class Command(BaseCommand):
+    help = 'Process queued price-list imports with a pool of local worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Number of worker processes')
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+
+    def handle(self, *args, **options):
+        if options['workers'] <= 1:
+            work(once=options['once'])
+            return
+
+        # forked children inherit the configured Django, spawned ones would
+        # use the ORM without django.setup(); they must not share connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(target=work, kwargs={'once': options['once']}) for _ in range(options['workers'])
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
@@ -0,0 +1,169 @@
+import heapq
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+
+class RequestMetrics:
+    """Timings of one request; also the execute wrapper that times its queries."""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql = 0.0
+        self.render = 0.0
+        self.total = 0.0
+        self.slowest = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.queries += 1
+            self.sql += duration
+            entry = (duration, self.queries, sql)
+            if len(self.slowest) < settings.SLOW_REQUEST_QUERIES:
+                heapq.heappush(self.slowest, entry)
+            else:
+                heapq.heappushpop(self.slowest, entry)
+
+    def server_timing(self):
+        timings = [f'total;dur={self.total * 1000:.1f}']
+        if self.queries:
+            timings.append(f'db;dur={self.sql * 1000:.1f};desc="{self.queries} queries"')
+        if self.render:
+            timings.append(f'render;dur={self.render * 1000:.1f}')
+        return ', '.join(timings)
+
+
+class LatencyHistograms:
+    """Per-view request latency histograms and SQL / render totals of this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def observe(self, view, metrics):
+        with self.lock:
+            stats = self.views.get(view)
+            if stats is None:
+                stats = self.views[view] = {
+                    'buckets': [0] * (len(settings.METRICS_LATENCY_BUCKETS) + 1),
+                    'count': 0, 'sum': 0.0, 'queries': 0, 'sql': 0.0, 'render': 0.0,
+                }
+            stats['buckets'][bisect_left(settings.METRICS_LATENCY_BUCKETS, metrics.total)] += 1
+            stats['count'] += 1
+            stats['sum'] += metrics.total
+            stats['queries'] += metrics.queries
+            stats['sql'] += metrics.sql
+            stats['render'] += metrics.render
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+
+    def render(self):
+        """The histograms in the Prometheus text exposition format."""
+        with self.lock:
+            views = {view: {**stats, 'buckets': list(stats['buckets'])} for view, stats in self.views.items()}
+
+        lines = [
+            '# HELP http_request_duration_seconds Request latency by view.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for view, stats in sorted(views.items()):
+            count = 0
+            bounds = [str(bound) for bound in settings.METRICS_LATENCY_BUCKETS] + ['+Inf']
+            for bound, observed in zip(bounds, stats['buckets']):
+                count += observed
+                lines.append(f'http_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {count}')
+            lines.append(f'http_request_duration_seconds_sum{{view="{view}"}} {stats["sum"]:.6f}')
+            lines.append(f'http_request_duration_seconds_count{{view="{view}"}} {stats["count"]}')
+        for name, key, help_text in (
+            ('http_request_queries_total', 'queries', 'SQL queries run by view.'),
+            ('http_request_sql_seconds_total', 'sql', 'Time spent in SQL by view.'),
+            ('http_request_render_seconds_total', 'render', 'Time spent rendering responses by view.'),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            lines += [f'{name}{{view="{view}"}} {stats[key]:g}' for view, stats in sorted(views.items())]
+        return '\n'.join(lines) + '\n'
+
+
+histograms = LatencyHistograms()
+
+
+class RequestMetricsMiddleware:
+    """
+    Times every request: query count and SQL time (through execute wrappers
+    on all database connections), response rendering and total time. Sends
+    them back as a Server-Timing header, feeds the per-view histograms served
+    by MetricsView and logs requests slower than SLOW_REQUEST_MS together
+    with their slowest queries.
+
+    Async views run their queries in other threads, so for them only the
+    total time is recorded.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        request.request_metrics = metrics = RequestMetrics()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics))
+            response = self.get_response(request)
+        metrics.total = time.perf_counter() - started
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        request.request_metrics = metrics = RequestMetrics()
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        metrics.total = time.perf_counter() - started
+        return self.finish(request, response, metrics)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after every process_template_response hook
+        started = time.perf_counter()
+
+        def rendered(response):
+            request.request_metrics.render = time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def finish(self, request, response, metrics):
+        view = request.resolver_match.url_name if request.resolver_match else 'unmatched'
+        histograms.observe(view, metrics)
+        response['Server-Timing'] = metrics.server_timing()
+
+        if metrics.total * 1000 >= settings.SLOW_REQUEST_MS:
+            logger.warning(
+                'Slow request %s %s: %.1f ms, %d queries in %.1f ms, render %.1f ms%s',
+                request.method, request.get_full_path(), metrics.total * 1000, metrics.queries,
+                metrics.sql * 1000, metrics.render * 1000,
+                ''.join(
+                    f'\n  {duration * 1000:.1f} ms: {sql[:settings.SLOW_REQUEST_SQL_LENGTH]}'
+                    for duration, _, sql in sorted(metrics.slowest, reverse=True)
+                )
+            )
+        return response
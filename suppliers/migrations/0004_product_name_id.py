@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-18 20:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('suppliers', '0003_product_info_shop_external'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-name', '-id'], name='product_name_id'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.0.2 on 2026-10-18 20:40
+
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+POPULATE_CATALOG = '''
+    INSERT INTO suppliers_catalogoffer (
+        offer_id, product_id, product_name, category_id, shop_id, shop_name,
+        name, model, price, price_rrp, quantity, parameters
+    )
+    SELECT info.id, product.id, product.name, product.category_id, shop.id, shop.name,
+           info.name, info.model, info.price, info.price_rrp, info.quantity,
+           COALESCE((
+               SELECT jsonb_object_agg(parameter.name, product_parameter.value)
+               FROM suppliers_productparameter product_parameter
+               JOIN suppliers_parameter parameter ON parameter.id = product_parameter.parameter_id
+               WHERE product_parameter.product_info_id = info.id
+           ), '{}'::jsonb)
+    FROM suppliers_productinfo info
+    JOIN suppliers_product product ON product.id = info.product_id
+    JOIN suppliers_shop shop ON shop.id = info.shop_id
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('suppliers', '0005_catalog_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogOffer',
+            fields=[
+                ('offer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='catalog_offer', serialize=False, to='suppliers.productinfo')),
+                ('product_id', models.BigIntegerField()),
+                ('product_name', models.CharField(max_length=128)),
+                ('category_id', models.BigIntegerField()),
+                ('shop_id', models.BigIntegerField()),
+                ('shop_name', models.CharField(max_length=128)),
+                ('name', models.CharField(max_length=128)),
+                ('model', models.CharField(blank=True, max_length=128)),
+                ('price', models.PositiveIntegerField()),
+                ('price_rrp', models.PositiveIntegerField()),
+                ('quantity', models.PositiveIntegerField()),
+                ('parameters', models.JSONField(default=dict)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-product_name', '-product_id', 'offer'], name='catalog_offer_product'), models.Index(fields=['shop_id'], name='catalog_offer_shop'), models.Index(fields=['category_id'], name='catalog_offer_category'), django.contrib.postgres.indexes.GinIndex(fields=['parameters'], name='catalog_offer_parameters')],
+            },
+        ),
+        migrations.RunSQL(POPULATE_CATALOG, migrations.RunSQL.noop),
+    ]
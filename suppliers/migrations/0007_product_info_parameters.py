@@ -0,0 +1,37 @@
+# Generated by Django 5.0.2 on 2026-10-18 20:43
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+COPY_PARAMETERS = '''
+    UPDATE suppliers_productinfo info
+    SET parameters = rows.parameters
+    FROM (
+        SELECT product_parameter.product_info_id, jsonb_object_agg(parameter.name, product_parameter.value) AS parameters
+        FROM suppliers_productparameter product_parameter
+        JOIN suppliers_parameter parameter ON parameter.id = product_parameter.parameter_id
+        GROUP BY product_parameter.product_info_id
+    ) rows
+    WHERE rows.product_info_id = info.id
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('suppliers', '0006_catalog_offer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productinfo',
+            name='parameters',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Parameters'),
+        ),
+        migrations.RunSQL(COPY_PARAMETERS, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['parameters'], name='product_info_parameters'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-18 20:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('suppliers', '0009_order_item_offer'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'status', '-time_created', '-id'], name='order_user_status_created'),
+        ),
+    ]
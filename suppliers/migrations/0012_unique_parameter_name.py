@@ -0,0 +1,43 @@
+# Generated by Django 5.0.2 on 2026-10-18 21:02
+
+from django.db import migrations, models
+
+
+# Merge parameters that share a name into the one with the lowest id
+MERGE_PARAMETERS = '''
+    SET CONSTRAINTS ALL IMMEDIATE;
+
+    UPDATE suppliers_productparameter product_parameter
+    SET parameter_id = duplicate.keep_id
+    FROM (
+        SELECT id, MIN(id) OVER (PARTITION BY name) AS keep_id FROM suppliers_parameter
+    ) duplicate
+    WHERE product_parameter.parameter_id = duplicate.id AND duplicate.id <> duplicate.keep_id;
+
+    DELETE FROM suppliers_productparameter product_parameter
+    USING suppliers_productparameter kept
+    WHERE product_parameter.product_info_id = kept.product_info_id
+      AND product_parameter.parameter_id = kept.parameter_id
+      AND product_parameter.id > kept.id;
+
+    DELETE FROM suppliers_parameter parameter
+    USING suppliers_parameter kept
+    WHERE parameter.name = kept.name AND parameter.id > kept.id;
+
+    SET CONSTRAINTS ALL DEFERRED;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('suppliers', '0011_outgoing_email'),
+    ]
+
+    operations = [
+        migrations.RunSQL(MERGE_PARAMETERS, migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name='parameter',
+            constraint=models.UniqueConstraint(fields=('name',), name='unique_parameter_name'),
+        ),
+    ]
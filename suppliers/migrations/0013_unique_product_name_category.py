@@ -0,0 +1,45 @@
+# Generated by Django 5.0.2 on 2026-10-18 21:08
+
+from django.db import migrations, models
+
+
+# Merge products that share a name and category into the one with the lowest
+# id. Offers are matched on (shop, external_id) by the importer, so two
+# duplicates never hold the same offer of a shop.
+MERGE_PRODUCTS = '''
+    SET CONSTRAINTS ALL IMMEDIATE;
+
+    CREATE TEMPORARY TABLE duplicate_product ON COMMIT DROP AS
+    SELECT id, keep_id FROM (
+        SELECT id, MIN(id) OVER (PARTITION BY name, category_id) AS keep_id FROM suppliers_product
+    ) product
+    WHERE id <> keep_id;
+
+    UPDATE suppliers_productinfo info SET product_id = duplicate.keep_id
+    FROM duplicate_product duplicate WHERE info.product_id = duplicate.id;
+
+    UPDATE suppliers_orderitem item SET product_id = duplicate.keep_id
+    FROM duplicate_product duplicate WHERE item.product_id = duplicate.id;
+
+    UPDATE suppliers_catalogoffer offer SET product_id = duplicate.keep_id
+    FROM duplicate_product duplicate WHERE offer.product_id = duplicate.id;
+
+    DELETE FROM suppliers_product product USING duplicate_product duplicate WHERE product.id = duplicate.id;
+
+    SET CONSTRAINTS ALL DEFERRED;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('suppliers', '0012_unique_parameter_name'),
+    ]
+
+    operations = [
+        migrations.RunSQL(MERGE_PRODUCTS, migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(fields=('name', 'category'), name='unique_product_name_category'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.2 on 2026-10-18 21:13
+
+from django.db import migrations, models
+
+
+FILL_SHOP_STATE = '''
+    UPDATE suppliers_catalogoffer catalog SET shop_state = FALSE
+    FROM suppliers_shop shop WHERE shop.id = catalog.shop_id AND NOT shop.state
+'''
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('suppliers', '0013_unique_product_name_category'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogoffer',
+            name='shop_state',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.RunSQL(FILL_SHOP_STATE, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='catalogoffer',
+            index=models.Index(condition=models.Q(('quantity__gt', 0), ('shop_state', True)), fields=['-product_name', '-product_id', 'offer'], name='catalog_offer_sellable'),
+        ),
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=models.Index(condition=models.Q(('quantity__gt', 0)), fields=['product', 'price'], name='product_info_in_stock_price'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-18 21:38
+
+from django.db import migrations, models
+
+
+FILL_HEARTBEAT = '''
+    UPDATE suppliers_importjob SET heartbeat_at = started_at WHERE status = 'running'
+'''
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('suppliers', '0015_product_name_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunSQL(FILL_HEARTBEAT, migrations.RunSQL.noop),
+    ]
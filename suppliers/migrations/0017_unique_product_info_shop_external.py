@@ -0,0 +1,59 @@
+# Generated by Django 5.0.2 on 2026-10-18 21:39
+
+from django.db import migrations, models
+
+
+# Keep the newest offer of each (shop, external_id), the one the last import
+# wrote. Order items move to it unless their order already holds it; the rest
+# lose the link, as deleting the offer would do (SET_NULL).
+DELETE_DUPLICATE_OFFERS = '''
+    SET CONSTRAINTS ALL IMMEDIATE;
+
+    CREATE TEMPORARY TABLE duplicate_offer ON COMMIT DROP AS
+    SELECT id, keep_id FROM (
+        SELECT id, MAX(id) OVER (PARTITION BY shop_id, external_id) AS keep_id FROM suppliers_productinfo
+    ) info
+    WHERE id <> keep_id;
+
+    UPDATE suppliers_orderitem item SET product_info_id = duplicate.keep_id
+    FROM duplicate_offer duplicate
+    WHERE item.product_info_id = duplicate.id AND NOT EXISTS (
+        SELECT 1 FROM suppliers_orderitem kept
+        WHERE kept.order_id = item.order_id AND kept.product_info_id = duplicate.keep_id
+    );
+
+    UPDATE suppliers_orderitem item SET product_info_id = NULL
+    FROM duplicate_offer duplicate WHERE item.product_info_id = duplicate.id;
+
+    DELETE FROM suppliers_productparameter parameter
+    USING duplicate_offer duplicate WHERE parameter.product_info_id = duplicate.id;
+
+    DELETE FROM suppliers_catalogoffer offer USING duplicate_offer duplicate WHERE offer.offer_id = duplicate.id;
+
+    DELETE FROM suppliers_productinfo info USING duplicate_offer duplicate WHERE info.id = duplicate.id;
+
+    SET CONSTRAINTS ALL DEFERRED;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('suppliers', '0016_import_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.RunSQL(DELETE_DUPLICATE_OFFERS, migrations.RunSQL.noop),
+        migrations.RemoveConstraint(
+            model_name='productinfo',
+            name='unique_product_info',
+        ),
+        migrations.RemoveIndex(
+            model_name='productinfo',
+            name='product_info_shop_external',
+        ),
+        migrations.AddConstraint(
+            model_name='productinfo',
+            constraint=models.UniqueConstraint(fields=('shop', 'external_id'), name='unique_product_info_shop_external'),
+        ),
+    ]
@@ -1,5 +1,8 @@
 from django.db import models
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager, Group, Permission
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django_rest_passwordreset.tokens import get_token_generator
 
@@ -14,6 +17,28 @@ STATUS_CHOICES = (
     ('canceled', 'Canceled'),
 )
 
+IMPORT_STATUS_CHOICES = (
+    ('queued', 'Queued'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+)
+
+EMAIL_STATUS_CHOICES = (
+    ('queued', 'Queued'),
+    ('sent', 'Sent'),
+    ('failed', 'Failed'),
+)
+
+EMAIL_KIND_CHOICES = (
+    ('confirm_email', 'Email confirmation'),
+    ('order_status', 'Order status'),
+)
+
+# Text search configuration of product names; 'russian' stems Cyrillic words
+# and hands Latin ones to the english stemmer, which suits mixed names
+SEARCH_CONFIG = 'russian'
+
 
 class UserManager(BaseUserManager):
     def _create_user(self, email, password, first_name, last_name, **extra_fields):
@@ -141,6 +166,15 @@ class Product(models.Model):
 
     class Meta:
         ordering = ('-name',)
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'category'], name='unique_product_name_category'),
+        ]
+        indexes = [
+            models.Index(fields=['-name', '-id'], name='product_name_id'),
+            # /products/search/: full-text search and trigram word similarity
+            GinIndex(SearchVector('name', config=SEARCH_CONFIG), name='product_name_search'),
+            GinIndex(OpClass('name', name='gin_trgm_ops'), name='product_name_trgm'),
+        ]
 
 
 class ProductInfo(models.Model):
@@ -152,10 +186,22 @@ class ProductInfo(models.Model):
     quantity = models.PositiveIntegerField(verbose_name='Quantity')
     price = models.PositiveIntegerField(verbose_name='Price')
     price_rrp = models.PositiveIntegerField(verbose_name='Recommended price')
+    # name -> value document, used instead of ProductParameter rows when
+    # settings.PRODUCT_PARAMETER_STORAGE is 'json'
+    parameters = models.JSONField(verbose_name='Parameters', default=dict, blank=True)
 
     class Meta:
         constraints = [
-            models.UniqueConstraint(fields=['product', 'shop', 'external_id'], name='unique_product_info'),
+            # the importer matches offers on (shop, external_id)
+            models.UniqueConstraint(fields=['shop', 'external_id'], name='unique_product_info_shop_external'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'price'], name='product_info_product_price'),
+            models.Index(
+                fields=['product', 'price'], name='product_info_in_stock_price', condition=models.Q(quantity__gt=0)
+            ),
+            models.Index(fields=['shop', 'price'], name='product_info_shop_price'),
+            GinIndex(fields=['parameters'], name='product_info_parameters'),
         ]
 
 
@@ -167,6 +213,9 @@ class Parameter(models.Model):
 
     class Meta:
         ordering = ('-name',)
+        constraints = [
+            models.UniqueConstraint(fields=['name'], name='unique_parameter_name'),
+        ]
 
 
 class ProductParameter(models.Model):
@@ -180,6 +229,47 @@ class ProductParameter(models.Model):
     )
     value = models.CharField(max_length=128)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['parameter', 'value', 'product_info'], name='product_parameter_value'),
+        ]
+
+
+class CatalogOffer(models.Model):
+    """
+    Denormalized read model of the catalog: one row per offer with its
+    product, shop name and parameters, kept in sync by suppliers.catalog.
+    """
+    offer = models.OneToOneField(
+        ProductInfo, primary_key=True,
+        related_name='catalog_offer', on_delete=models.CASCADE
+    )
+    product_id = models.BigIntegerField()
+    product_name = models.CharField(max_length=128)
+    category_id = models.BigIntegerField()
+    shop_id = models.BigIntegerField()
+    shop_name = models.CharField(max_length=128)
+    shop_state = models.BooleanField(default=True)
+    name = models.CharField(max_length=128)
+    model = models.CharField(max_length=128, blank=True)
+    price = models.PositiveIntegerField()
+    price_rrp = models.PositiveIntegerField()
+    quantity = models.PositiveIntegerField()
+    parameters = models.JSONField(default=dict)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-product_name', '-product_id', 'offer'], name='catalog_offer_product'),
+            # the catalog only shows offers of active shops that are in stock
+            models.Index(
+                fields=['-product_name', '-product_id', 'offer'], name='catalog_offer_sellable',
+                condition=models.Q(shop_state=True, quantity__gt=0)
+            ),
+            models.Index(fields=['shop_id'], name='catalog_offer_shop'),
+            models.Index(fields=['category_id'], name='catalog_offer_category'),
+            GinIndex(fields=['parameters'], name='catalog_offer_parameters'),
+        ]
+
 
 class Contact(models.Model):
     user = models.ForeignKey(
@@ -216,6 +306,12 @@ class Order(models.Model):
 
     class Meta:
         ordering = ('-time_created',)
+        constraints = [
+            models.UniqueConstraint(fields=['user'], condition=models.Q(status='cart'), name='unique_user_cart'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'status', '-time_created', '-id'], name='order_user_status_created'),
+        ]
 
     def __str__(self):
         return f'{self.time_created} {self.contact}'
@@ -225,7 +321,18 @@ class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='ordered_items', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, related_name='ordered_items', on_delete=models.CASCADE)
     shop = models.ForeignKey(Shop, related_name='ordered_items', on_delete=models.CASCADE)
+    product_info = models.ForeignKey(
+        ProductInfo, verbose_name='Offer',
+        related_name='ordered_items', blank=True, null=True,
+        on_delete=models.SET_NULL
+    )
     quantity = models.PositiveIntegerField()
+    price = models.PositiveIntegerField(verbose_name='Price', blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product_info'], name='unique_order_item'),
+        ]
 
 
 class ConfirmEmailToken(models.Model):
@@ -265,3 +372,61 @@ class ConfirmEmailToken(models.Model):
 
     def __str__(self):
         return "Password reset token for user {user}".format(user=self.user)
+
+
+class ImportJob(models.Model):
+    user = models.ForeignKey(
+        User, verbose_name='User',
+        related_name='import_jobs',
+        on_delete=models.CASCADE
+    )
+    file = models.FileField(upload_to='price_lists/')
+    streaming = models.BooleanField(default=False)
+    status = models.CharField(verbose_name='Status', choices=IMPORT_STATUS_CHOICES, max_length=15, default='queued')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    rows_processed = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    summary = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['status', 'id'], name='import_job_queue'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.status} {self.created_at}'
+
+
+class RevokedToken(models.Model):
+    jti = models.CharField(max_length=64, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.jti
+
+
+class OutgoingEmail(models.Model):
+    kind = models.CharField(verbose_name='Kind', choices=EMAIL_KIND_CHOICES, max_length=20)
+    to = models.EmailField(max_length=255)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    status = models.CharField(verbose_name='Status', choices=EMAIL_STATUS_CHOICES, max_length=15, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    send_after = models.DateTimeField(verbose_name='Send after', default=timezone.now)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['status', 'send_after', 'id'], name='outgoing_email_queue'),
+        ]
+
+    def __str__(self):
+        return f'{self.to} {self.subject} {self.status}'
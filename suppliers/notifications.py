@@ -0,0 +1,103 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import STATUS_CHOICES, ConfirmEmailToken, OutgoingEmail, User
+
+
+def queue_email(kind, to, subject, body):
+    """
+    Record an email for the email workers. Called inside the request's
+    transaction, so the email is queued only if the change it reports commits.
+    """
+    return OutgoingEmail.objects.create(kind=kind, to=to, subject=subject, body=body)
+
+
+def queue_confirmation(user):
+    token = ConfirmEmailToken.objects.create(user=user)
+    return queue_email(
+        'confirm_email', user.email, 'Confirm your email',
+        f'Hello, {user.first_name}!\n\nYour email confirmation token: {token.key}\n'
+    )
+
+
+def queue_order_status(order):
+    email = User.objects.values_list('email', flat=True).get(id=order.user_id)
+    status = dict(STATUS_CHOICES)[order.status]
+    return queue_email(
+        'order_status', email, f'Order #{order.id}: {status}',
+        f'The status of your order #{order.id} is now "{status}".\n'
+    )
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=settings.EMAIL_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def claim_batch(batch_size=None):
+    """
+    Take up to `batch_size` due emails for this worker: their send_after is
+    moved EMAIL_CLAIM_TIMEOUT seconds ahead, so other workers skip them while
+    they are being sent, and they become due again if this worker dies.
+    """
+    with transaction.atomic():
+        emails = list(OutgoingEmail.objects.select_for_update(skip_locked=True).filter(
+            status='queued', send_after__lte=timezone.now()
+        ).order_by('id')[:batch_size or settings.EMAIL_BATCH_SIZE])
+        OutgoingEmail.objects.filter(id__in=[email.id for email in emails]).update(
+            send_after=timezone.now() + timedelta(seconds=settings.EMAIL_CLAIM_TIMEOUT)
+        )
+    return emails
+
+
+def send_batch(batch_size=None):
+    """
+    Send up to `batch_size` due emails over a single SMTP connection.
+
+    The batch is claimed in a short transaction and sent outside of it, so no
+    row lock or transaction stays open during SMTP traffic. Failed emails are
+    retried with exponential backoff until EMAIL_MAX_ATTEMPTS.
+    """
+    emails = claim_batch(batch_size)
+    if not emails:
+        return 0
+
+    connection = get_connection()
+    try:
+        for email in emails:
+            email.attempts += 1
+            try:
+                # no-op while the connection is open; the backend would
+                # otherwise open and close one per message
+                connection.open()
+                EmailMessage(email.subject, email.body, to=[email.to], connection=connection).send()
+            except Exception as e:
+                # drop a possibly broken connection, the next email reopens it
+                connection.close()
+                email.last_error = str(e)
+                if email.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+                    email.status = 'failed'
+                else:
+                    email.send_after = timezone.now() + retry_delay(email.attempts)
+            else:
+                email.status = 'sent'
+                email.sent_at = timezone.now()
+    finally:
+        connection.close()
+
+    OutgoingEmail.objects.bulk_update(emails, ['status', 'attempts', 'last_error', 'send_after', 'sent_at'])
+    return len(emails)
+
+
+def work(once=False):
+    """Send queued emails; with `once` stop as soon as nothing is due."""
+    while True:
+        if send_batch():
+            continue
+        if once:
+            return
+        time.sleep(settings.EMAIL_WORKER_POLL_INTERVAL)
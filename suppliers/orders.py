@@ -0,0 +1,129 @@
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from rest_framework.exceptions import ValidationError
+
+from .cache import bump_catalog_version
+from .models import STATUS_CHOICES, Order, OrderItem, ProductInfo, CatalogOffer, Contact
+
+
+class OutOfStock(Exception):
+
+    def __init__(self, offer_id):
+        super().__init__(f'Not enough stock for offer {offer_id}')
+        self.offer_id = offer_id
+
+
+def get_cart(user):
+    # the unique_user_cart constraint makes concurrent get_or_create calls
+    # agree on a single cart
+    cart, created = Order.objects.get_or_create(user_id=user.id, status='cart')
+    return cart
+
+
+def add_to_cart(user, items):
+    """Add `items` ({offer id: quantity}) to the cart, summing with the quantities already there."""
+    offers = {
+        offer['id']: offer for offer in ProductInfo.objects.filter(id__in=items, shop__state=True).values(
+            'id', 'product_id', 'shop_id'
+        )
+    }
+    unknown = sorted(set(items) - set(offers))
+    if unknown:
+        raise ValidationError({'items': f'Unknown offers: {unknown}'})
+
+    with transaction.atomic():
+        cart = get_cart(user)
+        in_cart = set(cart.ordered_items.filter(product_info_id__in=items).values_list('product_info_id', flat=True))
+        for offer_id in in_cart:
+            cart.ordered_items.filter(product_info_id=offer_id).update(quantity=F('quantity') + items[offer_id])
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=cart, product_info_id=offer_id, product_id=offers[offer_id]['product_id'],
+                shop_id=offers[offer_id]['shop_id'], quantity=quantity
+            )
+            for offer_id, quantity in items.items() if offer_id not in in_cart
+        ])
+    return cart
+
+
+def update_cart(user, items):
+    """Set the quantities of cart items; returns the offer ids that are not in the cart."""
+    with transaction.atomic():
+        cart = get_cart(user)
+        ordered_items = list(cart.ordered_items.filter(product_info_id__in=items))
+        for item in ordered_items:
+            item.quantity = items[item.product_info_id]
+        OrderItem.objects.bulk_update(ordered_items, ['quantity'])
+    return sorted(set(items) - {item.product_info_id for item in ordered_items})
+
+
+def remove_from_cart(user, offer_ids):
+    deleted, _ = OrderItem.objects.filter(
+        order__user_id=user.id, order__status='cart', product_info_id__in=offer_ids
+    ).delete()
+    return deleted
+
+
+def reserve_stock(offer_id, quantity):
+    """
+    Take `quantity` units of an offer with a single conditional UPDATE: no
+    read-modify-write, and concurrent checkouts of the same offer only wait
+    for each other's row lock instead of overselling.
+    """
+    if not ProductInfo.objects.filter(id=offer_id, quantity__gte=quantity).update(
+        quantity=F('quantity') - quantity
+    ):
+        raise OutOfStock(offer_id)
+    CatalogOffer.objects.filter(offer_id=offer_id).update(
+        quantity=Subquery(ProductInfo.objects.filter(id=offer_id).values('quantity'))
+    )
+
+
+def checkout(user, contact_id):
+    """Confirm the cart of `user`, fixing item prices and taking their stock in one transaction."""
+    with transaction.atomic():
+        # locks only the buyer's own cart, so a double submit waits here
+        cart = Order.objects.select_for_update().filter(user_id=user.id, status='cart').first()
+        ordered_items = list(cart.ordered_items.select_related('product_info')) if cart else []
+        if not ordered_items:
+            raise ValidationError({'cart': 'Cart is empty'})
+        if not Contact.objects.filter(id=contact_id, user_id=user.id).exists():
+            raise ValidationError({'contact': 'Contact not found'})
+
+        for item in ordered_items:
+            if item.product_info is None:
+                raise ValidationError({'items': 'Cart holds offers that are no longer available'})
+            item.price = item.product_info.price
+        OrderItem.objects.bulk_update(ordered_items, ['price'])
+        # also queues the status email (signals.order_saved), before any offer is locked
+        cart.status = 'confirmed'
+        cart.contact_id = contact_id
+        cart.save(update_fields=['status', 'contact'])
+
+        # Offer rows stay locked from their UPDATE until commit, so stock is
+        # taken last, in offer id order to rule out deadlocks between carts
+        # sharing several offers.
+        for item in sorted(ordered_items, key=lambda item: item.product_info_id):
+            reserve_stock(item.product_info_id, item.quantity)
+
+        shop_ids = {item.shop_id for item in ordered_items}
+        transaction.on_commit(lambda: bump_catalog_version(*shop_ids))
+    return cart
+
+
+def order_history(user, status=None):
+    """
+    Orders of `user` (all but the cart unless `status` is given), annotated
+    with their item count and total. The sums are correlated subqueries, so
+    they are computed only for the rows of the requested page.
+    """
+    statuses = [status] if status else [value for value, label in STATUS_CHOICES if value != 'cart']
+    items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    return Order.objects.filter(user_id=user.id, status__in=statuses).annotate(
+        item_count=Coalesce(Subquery(items.annotate(count=Sum('quantity')).values('count')), 0),
+        # items checked out before prices were stored fall back to the offer price
+        total=Coalesce(Subquery(items.annotate(
+            total=Sum(F('quantity') * Coalesce('price', 'product_info__price'))
+        ).values('total')), 0),
+    )
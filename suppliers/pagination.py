@@ -0,0 +1,113 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over (name, id) in descending order; subclasses may
+    swap `name` for another column through `ordering` and `parse_value`.
+
+    The cursor holds the last row's name and id, so every page is an index
+    range scan starting right after the previous one: no COUNT(*) and no
+    OFFSET, and rows inserted meanwhile never shift page boundaries.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    ordering = ('-name', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        position = self.get_position(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        field = self.ordering[0].lstrip('-')
+        if position is not None:
+            value, pk = position
+            # `<field> <= %s` gives the planner an index bound to start from
+            queryset = queryset.filter(
+                Q(**{f'{field}__lt': value}) | Q(id__lt=pk), **{f'{field}__lte': value}
+            )
+
+        return self.get_page(list(queryset[:self.page_size + 1]), lambda obj: (getattr(obj, field), obj.id))
+
+    def get_position(self, request):
+        """Read page size and cursor position of the request."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        return self.decode_cursor(request)
+
+    def get_page(self, rows, position):
+        """Trim `page_size + 1` fetched rows to a page and remember where the next one starts."""
+        self.has_next = len(rows) > self.page_size
+        page = rows[:self.page_size]
+        self.next_position = position(page[-1]) if self.has_next else None
+        return page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value, pk = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            return self.parse_value(value), int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def parse_value(self, value):
+        return str(value)
+
+    def encode_cursor(self, position):
+        return urlsafe_b64encode(json.dumps(position, default=str).encode('utf-8')).decode('ascii')
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class TimeCreatedPagination(KeysetPagination):
+    """Newest first, over (time_created, id)."""
+    page_size = 20
+    ordering = ('-time_created', '-id')
+
+    def parse_value(self, value):
+        return datetime.fromisoformat(value)
+
+
+class RankPagination(KeysetPagination):
+    """Most relevant first, over (rank, id) of search results."""
+    page_size = 20
+    ordering = ('-rank', '-id')
+
+    def parse_value(self, value):
+        return float(value)
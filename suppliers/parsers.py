@@ -0,0 +1,84 @@
+import yaml
+from django.utils.encoding import force_str
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework_yaml.parsers import YAMLParser
+
+
+class CustomYamlParser(YAMLParser):
+    media_type = "text/yaml"
+
+
+class PriceListStream:
+    """
+    Lazily parsed price list.
+
+    Every top-level section before `goods` is loaded on construction, `goods`
+    itself is yielded one item at a time straight from the request stream,
+    so memory stays bounded by the size of a single item.
+    """
+
+    def __init__(self, stream):
+        self.loader = yaml.SafeLoader(stream)
+        self.header = {}
+        self.consumed = False
+        try:
+            self.loader.get_event()
+            self.loader.get_event()
+            if not self.loader.check_event(yaml.MappingStartEvent):
+                raise ParseError('YAML parse error - price list must be a mapping')
+            self.loader.get_event()
+            self.read_header()
+        except yaml.YAMLError as exc:
+            raise ParseError("YAML parse error - %s" % force_str(exc))
+
+    def __getitem__(self, key):
+        if key == 'goods':
+            return self.goods()
+        return self.header[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def read_node(self):
+        return self.loader.construct_document(self.loader.compose_node(None, None))
+
+    def read_header(self):
+        while not self.loader.check_event(yaml.MappingEndEvent):
+            key = self.read_node()
+            if key == 'goods':
+                return
+            self.header[key] = self.read_node()
+
+    def goods(self):
+        if self.consumed:
+            raise ParseError('Price list goods can only be read once')
+        self.consumed = True
+        if self.loader.check_event(yaml.MappingEndEvent):
+            return
+
+        try:
+            if not self.loader.check_event(yaml.SequenceStartEvent):
+                raise ParseError("YAML parse error - 'goods' must be a list")
+            self.loader.get_event()
+            while not self.loader.check_event(yaml.SequenceEndEvent):
+                yield self.read_node()
+            self.loader.get_event()
+            if not self.loader.check_event(yaml.MappingEndEvent):
+                raise ParseError("YAML parse error - 'goods' must be the last section of a streamed price list")
+        except yaml.YAMLError as exc:
+            raise ParseError("YAML parse error - %s" % force_str(exc))
+
+
+class StreamingYamlParser(BaseParser):
+    """
+    Streaming counterpart of CustomYamlParser, selected with
+    `Content-Type: text/yaml; stream=true`.
+    """
+    media_type = "text/yaml; stream=true"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return PriceListStream(stream)
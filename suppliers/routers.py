@@ -0,0 +1,152 @@
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+# Set by ReplicaMiddleware for the duration of a request. Outside requests
+# (workers, management commands) it stays None and everything uses the primary.
+request_routing = ContextVar('request_routing', default=None)
+
+PINNED_KEY = 'replica:pinned:{}'
+CATALOG_CHANGED_KEY = 'replica:catalog_changed'
+
+
+class RequestRouting:
+    """Routing state of one request."""
+
+    def __init__(self, request, pinned):
+        self.request = request
+        self.pinned = pinned
+        self.wrote = False
+        self.user_checked = False
+        self.checking_user = False
+
+    def use_primary(self):
+        if self.pinned or self.user_checked or self.checking_user:
+            return self.pinned
+        # DRF authenticates inside the view, so look the user up lazily;
+        # resolving Django's session user queries the database and gets here again
+        self.checking_user = True
+        try:
+            user = getattr(self.request, 'user', None)
+            if user is not None and user.is_authenticated:
+                self.user_checked = True
+                self.pinned = bool(caches[settings.REPLICA_PIN_CACHE].get(PINNED_KEY.format(user.id)))
+        finally:
+            self.checking_user = False
+        return self.pinned
+
+
+def catalog_changed():
+    """Called with each catalog version bump, see pin_if_catalog_changed."""
+    if settings.DATABASE_REPLICAS:
+        caches[settings.REPLICA_PIN_CACHE].set(CATALOG_CHANGED_KEY, True, settings.REPLICA_PIN_SECONDS)
+
+
+def pin_if_catalog_changed():
+    """
+    Keep the rest of a request that is about to fill the catalog cache on the
+    primary if the catalog changed within REPLICA_PIN_SECONDS: a lagging
+    replica would store rows from before the change under the new version.
+    """
+    routing = request_routing.get()
+    if routing is not None and not routing.pinned and settings.DATABASE_REPLICAS:
+        routing.pinned = bool(caches[settings.REPLICA_PIN_CACHE].get(CATALOG_CHANGED_KEY))
+
+
+async def apin_if_catalog_changed():
+    routing = request_routing.get()
+    if routing is not None and not routing.pinned and settings.DATABASE_REPLICAS:
+        routing.pinned = bool(await caches[settings.REPLICA_PIN_CACHE].aget(CATALOG_CHANGED_KEY))
+
+
+class ReplicaRouter:
+    """
+    Sends reads of safe (GET/HEAD/OPTIONS) requests to a random alias of
+    DATABASE_REPLICAS and everything else to the primary.
+
+    Reads stay on the primary, so they see their own writes:
+    - within unsafe requests and atomic blocks;
+    - after the first write of a request;
+    - for REPLICA_PIN_SECONDS after a user's last write (see ReplicaMiddleware);
+    - on catalog cache misses for REPLICA_PIN_SECONDS after a catalog change.
+    """
+
+    def db_for_read(self, model, **hints):
+        routing = request_routing.get()
+        if (
+            routing is None or not settings.DATABASE_REPLICAS or routing.use_primary()
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        routing = request_routing.get()
+        if routing is not None:
+            routing.wrote = routing.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas follow the primary through streaming replication
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaMiddleware:
+    """
+    Opens the routing context of ReplicaRouter and remembers writers: after a
+    request that wrote, the user (or, for anonymous clients, a cookie) is
+    pinned to the primary for REPLICA_PIN_SECONDS, which covers the
+    replication lag.
+    """
+    cookie_name = 'pin_primary'
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def start(self, request):
+        pinned = request.method not in ('GET', 'HEAD', 'OPTIONS') or self.cookie_name in request.COOKIES
+        routing = RequestRouting(request, pinned)
+        return routing, request_routing.set(routing)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        routing, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_routing.reset(token)
+        return self.finish(request, response, routing)
+
+    async def __acall__(self, request):
+        routing, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_routing.reset(token)
+        return self.finish(request, response, routing)
+
+    def finish(self, request, response, routing):
+        if routing.wrote:
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                caches[settings.REPLICA_PIN_CACHE].set(PINNED_KEY.format(user.id), True, settings.REPLICA_PIN_SECONDS)
+            else:
+                response.set_cookie(self.cookie_name, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True)
+        return response
@@ -1,7 +1,13 @@
+from django.utils import timezone
 from rest_framework import serializers
 from django.contrib.auth import authenticate
-from .models import User, ProductInfo, Product, ProductParameter, Contact
+from .catalog import parameters_in_json
+from .models import User, ProductInfo, Product, ProductParameter, Contact, ImportJob, Order, OrderItem
 
+# upper bounds of the integer and bigint columns, so out of range input is a
+# 400 rather than a database error
+INTEGER_MAX = 2 ** 31 - 1
+BIGINT_MAX = 2 ** 63 - 1
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -45,12 +51,17 @@ class ProductParameterSerializer(serializers.ModelSerializer):
 
 class ProductInfoSerializer(serializers.ModelSerializer):
     shop = serializers.StringRelatedField()
-    product_parameters = ProductParameterSerializer(many=True, read_only=True)
+    product_parameters = serializers.SerializerMethodField()
 
     class Meta:
         model = ProductInfo
         fields = ['name', 'shop', 'product_parameters', 'price', 'quantity']
 
+    def get_product_parameters(self, obj):
+        if parameters_in_json():
+            return [{'parameter': name, 'value': value} for name, value in obj.parameters.items()]
+        return ProductParameterSerializer(obj.product_parameters.all(), many=True).data
+
 
 class ProductSerializer(serializers.ModelSerializer):
     product_info = ProductInfoSerializer(many=True, read_only=True)
@@ -71,3 +82,68 @@ class ContactSerializer(serializers.ModelSerializer):
             'user': {'write_only': True}
         }
 
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    rows_per_second = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImportJob
+        fields = [
+            'id', 'status', 'created_at', 'started_at', 'finished_at',
+            'rows_processed', 'rows_per_second', 'error_count', 'errors', 'summary'
+        ]
+
+    def get_rows_per_second(self, obj):
+        if not obj.started_at:
+            return 0
+        elapsed = ((obj.finished_at or timezone.now()) - obj.started_at).total_seconds()
+        return round(obj.rows_processed / elapsed, 1) if elapsed else 0
+
+
+class CartItemSerializer(serializers.Serializer):
+    product_info = serializers.IntegerField(min_value=1, max_value=BIGINT_MAX)
+    quantity = serializers.IntegerField(min_value=1, max_value=INTEGER_MAX)
+
+
+class OfferPatchSerializer(serializers.Serializer):
+    external_id = serializers.IntegerField(min_value=0, max_value=INTEGER_MAX)
+    price = serializers.IntegerField(min_value=0, max_value=INTEGER_MAX, required=False)
+    quantity = serializers.IntegerField(min_value=0, max_value=INTEGER_MAX, required=False)
+
+    def validate(self, attrs):
+        if 'price' not in attrs and 'quantity' not in attrs:
+            raise serializers.ValidationError('Expected price or quantity')
+        return attrs
+
+
+class OrderItemSerializer(serializers.ModelSerializer):
+    name = serializers.CharField(source='product_info.name', default=None)
+    shop = serializers.StringRelatedField()
+    price = serializers.SerializerMethodField()
+
+    class Meta:
+        model = OrderItem
+        fields = ['product_info', 'name', 'shop', 'price', 'quantity']
+
+    def get_price(self, obj):
+        # cart items follow the current offer price until checkout fixes it
+        if obj.price is None and obj.product_info is not None:
+            return obj.product_info.price
+        return obj.price
+
+
+class OrderSerializer(serializers.ModelSerializer):
+    ordered_items = OrderItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['id', 'status', 'time_created', 'contact', 'ordered_items']
+
+
+class OrderHistorySerializer(serializers.ModelSerializer):
+    item_count = serializers.IntegerField(read_only=True)
+    total = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['id', 'status', 'time_created', 'contact', 'item_count', 'total']
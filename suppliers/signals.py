@@ -0,0 +1,86 @@
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from .cache import bump_catalog_version
+from .catalog import refresh_catalog
+from .models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order
+from .notifications import queue_order_status
+
+
+# Bulk writes (bulk_create / bulk_update / update) send no signals, so the
+# import refreshes the read model and bumps catalog versions itself. There is
+# deliberately no delete receiver for ProductParameter: it would disable fast
+# cascade deletes.
+
+@receiver(post_save, sender=ProductInfo)
+def product_info_saved(sender, instance, **kwargs):
+    refresh_catalog(ProductInfo.objects.filter(id=instance.id))
+    transaction.on_commit(lambda: bump_catalog_version(instance.shop_id))
+
+
+@receiver(post_delete, sender=ProductInfo)
+def product_info_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_catalog_version(instance.shop_id))
+
+
+@receiver(post_save, sender=ProductParameter)
+def product_parameter_changed(sender, instance, **kwargs):
+    offers = ProductInfo.objects.filter(id=instance.product_info_id)
+    refresh_catalog(offers)
+    shop_ids = list(offers.values_list('shop_id', flat=True))
+    transaction.on_commit(lambda: bump_catalog_version(*shop_ids))
+
+
+@receiver(post_save, sender=Shop)
+def shop_changed(sender, instance, created, **kwargs):
+    if not created:
+        refresh_catalog(ProductInfo.objects.filter(shop_id=instance.id))
+    transaction.on_commit(lambda: bump_catalog_version(instance.id))
+
+
+@receiver(post_save, sender=Product)
+def product_changed(sender, instance, created, **kwargs):
+    if not created:
+        refresh_catalog(ProductInfo.objects.filter(product_id=instance.id))
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Parameter)
+def parameter_changed(sender, instance, created, **kwargs):
+    if not created:
+        refresh_catalog(ProductInfo.objects.filter(product_parameters__parameter_id=instance.id))
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(pre_delete, sender=Parameter)
+def parameter_deleting(sender, instance, **kwargs):
+    instance.catalog_offer_ids = list(
+        ProductInfo.objects.filter(product_parameters__parameter_id=instance.id).values_list('id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Parameter)
+def parameter_deleted(sender, instance, **kwargs):
+    refresh_catalog(ProductInfo.objects.filter(id__in=getattr(instance, 'catalog_offer_ids', [])))
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_init, sender=Order)
+def order_loaded(sender, instance, **kwargs):
+    # read from __dict__ so a deferred status is not fetched
+    instance.loaded_status = instance.__dict__.get('status')
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, created, **kwargs):
+    status = instance.__dict__.get('status')
+    # queued in the same transaction: the email goes out only if the change commits
+    if status not in (None, 'cart') and (created or status != instance.loaded_status):
+        queue_order_status(instance)
+    instance.loaded_status = status
@@ -1,3 +1,992 @@
-from django.test import TestCase
+import csv
+import io
+import socketserver
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest.mock import patch
 
-# Create your tests here.
+import msgpack
+import orjson
+import yaml
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.http import HttpResponse
+from django.test import (
+    AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed, ParseError
+from rest_framework.request import Request
+
+from .async_views import AsyncProductListView, AsyncLoginView, AsyncContactView, AsyncRegisterView
+from .authentication import TokenUser, issue_tokens, refresh_tokens
+from .benchmark import generate_catalog, price_list, write_price_list, measure
+from .cache import bump_catalog_version, get_cached_catalog
+from .catalog import refresh_catalog
+from .importer import PriceListImporter
+from .jobs import claim_job, report_progress, work
+from .models import (
+    User, Contact, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, CatalogOffer, Order,
+    OutgoingEmail, ImportJob,
+)
+from .metrics import histograms
+from .notifications import queue_email, send_batch
+from .orders import OutOfStock, add_to_cart, checkout
+from .parsers import PriceListStream
+from .routers import PINNED_KEY, ReplicaMiddleware, ReplicaRouter, RequestRouting, request_routing
+
+
+def create_catalog(products, shops=2, parameters=3):
+    shops = [Shop.objects.create(name=f'Shop {i}', url='https://example.com') for i in range(shops)]
+    category = Category.objects.create(name='Phones')
+    parameters = [Parameter.objects.get_or_create(name=f'Parameter {i}')[0] for i in range(parameters)]
+    for i in range(products):
+        product = Product.objects.create(name=f'Product {i}', category=category)
+        for shop in shops:
+            product_info = ProductInfo.objects.create(
+                product=product, shop=shop, external_id=i, name=product.name,
+                quantity=1, price=100, price_rrp=120,
+                parameters={parameter.name: str(i) for parameter in parameters}
+            )
+            ProductParameter.objects.bulk_create([
+                ProductParameter(product_info=product_info, parameter=parameter, value=str(i))
+                for parameter in parameters
+            ])
+    refresh_catalog(ProductInfo.objects.all())
+
+
+class ProductListViewTest(TestCase):
+    catalog_queries = 1
+
+    def setUp(self):
+        cache.clear()
+
+    def assertCatalogQueries(self, products, url=None):
+        with self.assertNumQueries(self.catalog_queries):
+            response = self.client.get(url or reverse('products') + '?facets=false')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), products)
+        return response.json()['results']
+
+    def test_query_count_does_not_grow_with_catalog(self):
+        create_catalog(2)
+        self.assertCatalogQueries(2)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_catalog(20)
+        self.assertCatalogQueries(22)
+
+    def test_unavailable_offers_hidden(self):
+        create_catalog(3, shops=2, parameters=0)
+        shop = Shop.objects.get(name='Shop 1')
+        shop.state = False
+        shop.save()
+        sold_out = ProductInfo.objects.get(product__name='Product 2', shop__name='Shop 0')
+        sold_out.quantity = 0
+        sold_out.save()
+
+        products = self.assertCatalogQueries(2)
+        self.assertEqual([(p['name'], [o['shop'] for o in p['product_info']]) for p in products], [
+            ('Product 1', ['Shop 0']), ('Product 0', ['Shop 0']),
+        ])
+        products = self.assertCatalogQueries(3, reverse('products') + '?facets=false&include_unavailable=true')
+        self.assertEqual(sum(len(p['product_info']) for p in products), 6)
+
+    def test_shop_filtered_response_sees_product_rename(self):
+        create_catalog(1, shops=2, parameters=0)
+        url = reverse('products') + f'?facets=false&shop={Shop.objects.get(name="Shop 0").id}'
+        self.assertEqual(self.client.get(url).json()['results'][0]['name'], 'Product 0')
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.get()
+            product.name = 'Renamed'
+            product.save()
+        self.assertEqual(self.client.get(url).json()['results'][0]['name'], 'Renamed')
+
+    def test_delete_unused_parameter(self):
+        create_catalog(1, parameters=1)
+        Parameter.objects.create(name='Unused').delete()
+        self.assertCatalogQueries(1)
+
+    def test_nested_offers(self):
+        create_catalog(1, shops=1, parameters=1)
+        product, = self.assertCatalogQueries(1)
+        self.assertEqual(product, {
+            'name': 'Product 0',
+            'product_info': [{
+                'name': 'Product 0', 'shop': 'Shop 0', 'price': 100, 'quantity': 1,
+                'product_parameters': [{'parameter': 'Parameter 0', 'value': '0'}],
+            }],
+        })
+
+    def test_keyset_pagination(self):
+        create_catalog(12, shops=1, parameters=1)
+        # same name, so only the id breaks the tie; (name, category) is unique
+        for product in Product.objects.filter(name__in=['Product 3', 'Product 4', 'Product 5']):
+            category = Category.objects.create(name=product.name)
+            Product.objects.filter(id=product.id).update(name='Product X', category=category)
+        refresh_catalog(ProductInfo.objects.all())
+        names, url = [], reverse('products') + '?page_size=2&facets=false'
+        while url:
+            with self.assertNumQueries(self.catalog_queries):
+                response = self.client.get(url).json()
+            names.extend(product['name'] for product in response['results'])
+            url = response['next']
+        self.assertEqual(names, list(Product.objects.order_by('-name', '-id').values_list('name', flat=True)))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('products') + '?cursor=broken')
+        self.assertEqual(response.status_code, 404)
+
+    def test_filters_and_facets(self):
+        create_catalog(4, shops=2, parameters=1)
+        cheap = ProductInfo.objects.filter(product__name='Product 1', shop__name='Shop 1').get()
+        cheap.price = 10
+        cheap.save()
+
+        with self.assertNumQueries(self.catalog_queries + 3):
+            response = self.client.get(reverse('products'), {'price_max': 50, 'parameter': 'Parameter 0:1'}).json()
+        product, = response['results']
+        self.assertEqual(product['name'], 'Product 1')
+        self.assertEqual([offer['shop'] for offer in product['product_info']], ['Shop 1'])
+        self.assertEqual(response['facets'], {
+            'categories': [{'id': cheap.product.category_id, 'name': 'Phones', 'count': 1}],
+            'shops': [{'id': cheap.shop_id, 'name': 'Shop 1', 'count': 1}],
+            'parameters': [{'parameter': 'Parameter 0', 'value': '1', 'count': 1}],
+        })
+
+    def test_invalid_filter(self):
+        response = self.client.get(reverse('products'), {'parameter': 'no separator'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_response_cache(self):
+        create_catalog(1, shops=1, parameters=1)
+        self.assertCatalogQueries(1)
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('products') + '?facets=false')
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductInfo.objects.update(price=1)
+            ProductInfo.objects.get().save()
+        product, = self.assertCatalogQueries(1)
+        self.assertEqual(product['product_info'][0]['price'], 1)
+
+    def test_msgpack_renderer(self):
+        create_catalog(2, shops=1, parameters=1)
+        json_response = self.client.get(reverse('products'))
+        response = self.client.get(reverse('products'), HTTP_ACCEPT='application/x-msgpack')
+        self.assertEqual(response['Content-Type'], 'application/x-msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), json_response.json())
+
+
+@override_settings(CATALOG_READ_MODEL=False)
+class NormalizedProductListViewTest(ProductListViewTest):
+    catalog_queries = 3
+
+
+@override_settings(CATALOG_READ_MODEL=False, PRODUCT_PARAMETER_STORAGE='json')
+class JSONParametersProductListViewTest(ProductListViewTest):
+    catalog_queries = 2
+
+
+class ProductSearchViewTest(TestCase):
+
+    def setUp(self):
+        create_catalog(3, shops=1, parameters=0)
+        names = ('Смартфон Apple iPhone 15', 'Apple MacBook Air 13', 'Чехол для iPhone 15')
+        for product, name in zip(Product.objects.order_by('id'), names):
+            product.name = name
+            product.save()
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('product search'), {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_full_text(self):
+        self.assertEqual([p['name'] for p in self.search('смартфоны')['results']], ['Смартфон Apple iPhone 15'])
+
+    def test_misspelled(self):
+        self.assertEqual([p['name'] for p in self.search('macbok')['results']], ['Apple MacBook Air 13'])
+
+    def test_ranked_pages(self):
+        first = self.search('iphone', page_size=1)
+        second = self.client.get(first['next']).json()
+        self.assertEqual(
+            {first['results'][0]['name'], second['results'][0]['name']},
+            {'Смартфон Apple iPhone 15', 'Чехол для iPhone 15'}
+        )
+        self.assertIsNone(second['next'])
+
+    def test_query_required(self):
+        self.assertEqual(self.client.get(reverse('product search')).status_code, 400)
+
+
+class ProductComparisonViewTest(TestCase):
+
+    def test_cheapest_and_best_stocked_offer(self):
+        create_catalog(2, shops=3, parameters=0)
+        for shop, price, quantity in zip(Shop.objects.order_by('name'), (300, 200, 100), (3, 7, 5)):
+            ProductInfo.objects.filter(shop=shop).update(price=price, price_rrp=250, quantity=quantity)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('product comparison'))
+        product = response.json()['results'][0]
+        self.assertEqual(product, {
+            'name': 'Product 1', 'offers': 3, 'min_price': 100, 'max_price': 300, 'shop': 'Shop 2',
+            'price_rrp': 250, 'discount': 150, 'discount_percent': 60.0, 'total_quantity': 15,
+            'best_stocked': {'shop': 'Shop 1', 'quantity': 7},
+        })
+
+    def test_only_filtered_offers_compared(self):
+        create_catalog(1, shops=2, parameters=0)
+        shop = Shop.objects.get(name='Shop 1')
+        response = self.client.get(reverse('product comparison') + f'?shop={shop.id}')
+        self.assertEqual([(p['offers'], p['shop']) for p in response.json()['results']], [(1, 'Shop 1')])
+
+
+class PriceListImporterTest(TestCase):
+
+    def setUp(self):
+        self.shop = Shop.objects.create(name='Shop', url='https://example.com')
+
+    def assertImportQueries(self, queries, items, batch_size):
+        """Import `items` offers into an empty catalog, which is rolled back afterwards."""
+        with self.assertNumQueries(queries), transaction.atomic():
+            PriceListImporter(self.shop, batch_size=batch_size).run(price_list('Shop', items, parameters=2))
+            transaction.set_rollback(True)
+
+    def test_query_count_depends_on_batches(self):
+        # a fixed number of queries per import plus 8 per batch, whatever the batch holds
+        self.assertImportQueries(20, items=5, batch_size=100)
+        self.assertImportQueries(20, items=50, batch_size=100)
+        self.assertImportQueries(28, items=50, batch_size=25)
+        self.assertImportQueries(52, items=50, batch_size=10)
+
+    def reimport(self, data, **kwargs):
+        importer = PriceListImporter(self.shop, **kwargs)
+        importer.run(data)
+        return importer.summary()
+
+    def changed_price_list(self):
+        """Price list of the initial import with item 1 repriced, item 2 and 3 parameters changed, item 4 gone."""
+        data = price_list('Shop', 5, parameters=2)
+        data['goods'][1]['price'] += 1
+        del data['goods'][2]['parameters']['Parameter 1']
+        data['goods'][3]['parameters']['Parameter 0'] = 'changed'
+        del data['goods'][4]
+        return data
+
+    def test_reimport(self):
+        self.reimport(price_list('Shop', 5, parameters=2))
+        summary = self.reimport(self.changed_price_list())
+        self.assertEqual(
+            [summary[key] for key in (
+                'offers', 'offers_created', 'offers_updated', 'offers_missing',
+                'product_parameters', 'product_parameters_removed',
+            )],
+            [4, 0, 1, 1, 1, 1]
+        )
+
+        offers = {offer.offer.external_id: offer for offer in CatalogOffer.objects.filter(shop_id=self.shop.id).select_related('offer')}
+        self.assertEqual(offers[1].price, 102)
+        self.assertEqual(offers[2].parameters, {'Parameter 0': '2'})
+        self.assertEqual(offers[3].parameters, {'Parameter 0': 'changed', 'Parameter 1': '4'})
+        self.assertEqual(offers[4].quantity, 0)
+        self.assertEqual(ProductInfo.objects.get(shop=self.shop, external_id=4).quantity, 0)
+        self.assertEqual(
+            ProductParameter.objects.filter(product_info__shop=self.shop, product_info__external_id=2).count(), 1
+        )
+
+        # nothing changed, nothing to write
+        summary = self.reimport(self.changed_price_list())
+        self.assertEqual(
+            [summary[key] for key in ('offers_updated', 'offers_missing', 'product_parameters')], [0, 0, 0]
+        )
+
+    def test_reimport_deletes_missing(self):
+        self.reimport(price_list('Shop', 5, parameters=2))
+        gone = ProductInfo.objects.get(shop=self.shop, external_id=4)
+        user, contact = create_buyer()
+        item = add_to_cart(user, {gone.id: 1}).ordered_items.get()
+
+        data = self.changed_price_list()
+        del data['goods'][1:]
+        # one catalog version bump for the import, none per deleted offer
+        with self.captureOnCommitCallbacks() as callbacks:
+            summary = self.reimport(data, missing='delete')
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(summary['offers_missing'], 4)
+        self.assertEqual(list(ProductInfo.objects.filter(shop=self.shop).values_list('external_id', flat=True)), [0])
+        self.assertFalse(ProductParameter.objects.exclude(product_info__external_id=0).exists())
+        item.refresh_from_db()
+        self.assertIsNone(item.product_info_id)
+        self.assertEqual(
+            list(CatalogOffer.objects.filter(shop_id=self.shop.id).values_list('offer__external_id', flat=True)), [0]
+        )
+
+    def test_duplicate_external_id(self):
+        data = price_list('Shop', 3, parameters=1)
+        data['goods'].append({**data['goods'][0], 'price': 1})
+        summary = self.reimport(data)
+        self.assertEqual((summary['offers'], summary['error_count']), (3, 1))
+        self.assertEqual(summary['errors'], [{'id': 0, 'error': 'Duplicate external id'}])
+        self.assertEqual(ProductInfo.objects.get(shop=self.shop, external_id=0).price, 100)
+
+    def test_offer_key_is_unique(self):
+        self.reimport(price_list('Shop', 1, parameters=0))
+        offer = ProductInfo.objects.get()
+        offer.pk, offer.product = None, Product.objects.create(name='Other', category_id=1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            offer.save()
+
+    def test_reimport_query_count_depends_on_batches(self):
+        counts = []
+        for items in (5, 50):
+            with transaction.atomic():
+                self.reimport(price_list('Shop', items, parameters=2))
+                data = price_list('Shop', items, parameters=2, offset=1)
+                del data['goods'][-1]
+                with CaptureQueriesContext(connection) as queries:
+                    summary = self.reimport(data, batch_size=100)
+                self.assertEqual(summary['offers_updated'], items - 1)
+                counts.append(len(queries))
+                transaction.set_rollback(True)
+        self.assertEqual(counts[0], counts[1])
+
+
+def price_list_stream(data):
+    return io.BytesIO(yaml.safe_dump(data, sort_keys=False, allow_unicode=True).encode())
+
+
+class PriceListStreamTest(TestCase):
+
+    def test_header_and_goods(self):
+        data = price_list('Shop', 3, parameters=1)
+        stream = PriceListStream(price_list_stream(data))
+        self.assertEqual((stream['shop'], stream['categories']), (data['shop'], data['categories']))
+        self.assertEqual(list(stream['goods']), data['goods'])
+        with self.assertRaises(ParseError):
+            list(stream['goods'])
+
+    def test_goods_must_be_last(self):
+        data = price_list('Shop', 3, parameters=1)
+        stream = PriceListStream(price_list_stream({'goods': data['goods'], 'shop': data['shop']}))
+        with self.assertRaisesMessage(ParseError, 'last section'):
+            list(stream['goods'])
+
+    def test_not_a_mapping(self):
+        with self.assertRaisesMessage(ParseError, 'must be a mapping'):
+            PriceListStream(io.BytesIO(b'- shop\n- goods\n'))
+        with self.assertRaises(ParseError):
+            PriceListStream(io.BytesIO(b'shop: [unclosed\n'))
+
+    def test_failed_batch_is_rolled_back(self):
+        data = price_list('Shop', 5, parameters=1)
+        data['goods'][2]['price'] = 'not a price'
+        shop = Shop.objects.create(name='Shop', url='https://example.com')
+
+        summary = PriceListImporter(shop, batch_size=2).run_batches(PriceListStream(price_list_stream(data)))
+        self.assertEqual((summary['offers'], summary['error_count']), (3, 1))
+        self.assertEqual((summary['errors'][0]['batch'], summary['errors'][0]['items']), (1, 2))
+        self.assertEqual(
+            list(ProductInfo.objects.order_by('external_id').values_list('external_id', flat=True)), [0, 1, 4]
+        )
+        self.assertFalse(Product.objects.filter(name__in=['Product 2', 'Product 3']).exists())
+        self.assertEqual(CatalogOffer.objects.count(), 3)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class YAMLLoadViewTest(TestCase):
+
+    def setUp(self):
+        seller = User.objects.create_user('seller@example.com', 'secret-password', 'Jane', 'Doe', type='seller')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {issue_tokens(seller)["access"]}'
+        self.price_list = yaml.safe_dump(price_list('Shop', 3, parameters=1), sort_keys=False)
+
+    def test_stream_parameter_selects_streaming_parser(self):
+        for content_type, streaming in (('text/yaml; stream=true', True), ('text/yaml', False)):
+            response = self.client.post(reverse('yaml load'), self.price_list, content_type=content_type)
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(ImportJob.objects.get(id=response.json()['Job']).streaming, streaming)
+
+    def load(self, price_list):
+        return self.client.post(reverse('yaml load'), price_list, content_type='text/yaml; stream=true').json()['Job']
+
+    def test_import_job(self):
+        url = reverse('import job', args=[self.load(self.price_list)])
+        self.assertEqual(self.client.get(url).json()['status'], 'queued')
+        work(once=True)
+        job = self.client.get(url).json()
+        self.assertEqual((job['status'], job['rows_processed'], job['error_count']), ('done', 3, 0))
+        self.assertEqual(job['summary']['offers_created'], 3)
+        self.assertEqual(ProductInfo.objects.filter(shop__name='Shop').count(), 3)
+
+    def test_unreadable_price_list_fails_job(self):
+        data = price_list('Shop', 3, parameters=1)
+        job_id = self.load(yaml.safe_dump(
+            {'shop': data['shop'], 'goods': data['goods'], 'categories': data['categories']}, sort_keys=False
+        ))
+        work(once=True)
+        job = ImportJob.objects.get(id=job_id)
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('last section', job.errors[-1]['error'])
+
+    def test_stale_running_job_is_requeued(self):
+        job_id = self.load(self.price_list)
+        stale = timezone.now() - timedelta(seconds=settings.IMPORT_JOB_TIMEOUT + 1)
+        # a long import keeps its job through the heartbeat
+        ImportJob.objects.filter(id=job_id).update(status='running', started_at=stale, heartbeat_at=timezone.now())
+        self.assertIsNone(claim_job())
+        ImportJob.objects.filter(id=job_id).update(heartbeat_at=stale)
+        self.assertEqual(claim_job().id, job_id)
+
+    def test_progress_refreshes_heartbeat(self):
+        self.load(self.price_list)
+        job = claim_job()
+        stale = timezone.now() - timedelta(seconds=settings.IMPORT_JOB_TIMEOUT + 1)
+        ImportJob.objects.filter(id=job.id).update(heartbeat_at=stale)
+        report_progress(job, PriceListImporter(Shop.objects.create(name='Shop')))
+        self.assertGreater(ImportJob.objects.get(id=job.id).heartbeat_at, stale)
+        self.assertIsNone(claim_job())
+
+    def test_price_list_required(self):
+        response = self.client.post(reverse('yaml load'), {'shop': 'Shop'}, content_type='application/json')
+        self.assertEqual(response.json()['Status'], 'Failed')
+
+
+class SignedTokenAuthenticationTest(TestCase):
+
+    def setUp(self):
+        User.objects.create_user('buyer@example.com', 'secret-password', 'John', 'Doe', type='buyer')
+        response = self.client.post(reverse('login'), {'email': 'buyer@example.com', 'password': 'secret-password'})
+        self.tokens = response.json()
+
+    def test_access_token_needs_no_lookup(self):
+        Contact.objects.create(
+            user=User.objects.get(), last_name='Doe', first_name='John', email='buyer@example.com',
+            city='Moscow', street='Tverskaya', phone='123'
+        )
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('contact'), HTTP_AUTHORIZATION=f'Bearer {self.tokens["access"]}')
+        self.assertEqual(len(response.json()), 1)
+
+    def test_refresh_rotates_and_revokes(self):
+        response = self.client.post(reverse('token refresh'), {'refresh': self.tokens['refresh']}).json()
+        self.assertEqual(response['Status'], 'OK')
+        self.assertIn('access', response)
+
+        response = self.client.post(reverse('token refresh'), {'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, 403)
+
+    def test_invalid_token(self):
+        response = self.client.get(reverse('contact'), HTTP_AUTHORIZATION='Bearer broken')
+        self.assertEqual(response.status_code, 401)
+
+
+class ConcurrentRefreshTest(TransactionTestCase):
+
+    def test_refresh_token_used_once(self):
+        user = User.objects.create_user('buyer@example.com', 'secret-password', 'John', 'Doe', type='buyer')
+        refresh = issue_tokens(user)['refresh']
+        barrier = threading.Barrier(8)
+
+        def rotate(_):
+            barrier.wait()
+            try:
+                refresh_tokens(refresh)
+                return True
+            except AuthenticationFailed:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(rotate, range(8)))
+        self.assertEqual(results.count(True), 1)
+
+
+class AsyncViewsTest(TestCase):
+    factory = AsyncRequestFactory()
+
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user('buyer@example.com', 'secret-password', 'John', 'Doe', type='buyer')
+
+    async def test_catalog(self):
+        await sync_to_async(create_catalog)(3, shops=1, parameters=1)
+        response = await AsyncProductListView.as_view()(self.factory.get('/products/?page_size=2'))
+        data = orjson.loads(response.content)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual([product['name'] for product in data['results']], ['Product 2', 'Product 1'])
+        self.assertEqual([shop['count'] for shop in data['facets']['shops']], [3])
+
+        response = await AsyncProductListView.as_view()(self.factory.get(data['next']))
+        self.assertEqual([product['name'] for product in orjson.loads(response.content)['results']], ['Product 0'])
+
+        response = await AsyncProductListView.as_view()(self.factory.get('/products/?page_size=2'))
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(orjson.loads(response.content), data)
+
+    async def test_register_rolls_back_on_failure(self):
+        request = self.factory.post('/register/', {
+            'email': 'new@example.com', 'password': 'secret-password',
+            'first_name': 'Jane', 'last_name': 'Doe', 'type': 'buyer',
+        }, content_type='application/json')
+        with patch('suppliers.async_views.queue_confirmation', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                await AsyncRegisterView.as_view()(request)
+        self.assertFalse(await User.objects.filter(email='new@example.com').aexists())
+
+        response = await AsyncRegisterView.as_view()(request)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(await Token.objects.filter(user__email='new@example.com').aexists())
+
+    async def test_login_and_contact(self):
+        request = self.factory.post(
+            '/login/', {'email': 'buyer@example.com', 'password': 'wrong'}, content_type='application/json'
+        )
+        self.assertEqual((await AsyncLoginView.as_view()(request)).status_code, 400)
+
+        request = self.factory.post(
+            '/login/', {'email': 'buyer@example.com', 'password': 'secret-password'}, content_type='application/json'
+        )
+        tokens = orjson.loads((await AsyncLoginView.as_view()(request)).content)
+
+        request = self.factory.post(
+            '/contact/', {
+                'last_name': 'Doe', 'first_name': 'John', 'email': 'buyer@example.com',
+                'city': 'Moscow', 'street': 'Tverskaya', 'phone': '123'
+            },
+            content_type='application/json', headers={'Authorization': f'Bearer {tokens["access"]}'}
+        )
+        self.assertEqual(orjson.loads((await AsyncContactView.as_view()(request)).content), {'Status': 'Success'})
+
+        request = self.factory.get('/contact/', headers={'Authorization': f'Token {tokens["token"]}'})
+        contact, = orjson.loads((await AsyncContactView.as_view()(request)).content)
+        self.assertEqual(contact['city'], 'Moscow')
+
+
+def create_buyer(email='buyer@example.com'):
+    user = User.objects.create_user(email, 'secret-password', 'John', 'Doe', type='buyer')
+    contact = Contact.objects.create(
+        user=user, last_name='Doe', first_name='John', email=email, city='Moscow', street='Tverskaya', phone='123'
+    )
+    return user, contact
+
+
+class CartViewTest(TestCase):
+
+    def setUp(self):
+        create_catalog(2, shops=1, parameters=0)
+        ProductInfo.objects.update(quantity=5)
+        refresh_catalog(ProductInfo.objects.all())
+        self.offers = list(ProductInfo.objects.order_by('id').values_list('id', flat=True))
+        self.user, self.contact = create_buyer()
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {issue_tokens(self.user)["access"]}'
+
+    def test_cart_and_checkout(self):
+        url = reverse('cart')
+        items = [{'product_info': offer, 'quantity': 2} for offer in self.offers]
+        self.assertEqual(self.client.post(url, {'items': items}, content_type='application/json').json()['Status'], 'OK')
+        self.client.post(url, {'items': items[:1]}, content_type='application/json')
+        self.client.put(url, {'items': [{'product_info': self.offers[1], 'quantity': 1}]}, content_type='application/json')
+        cart = self.client.get(url).json()
+        self.assertEqual([item['quantity'] for item in cart['ordered_items']], [4, 1])
+
+        response = self.client.post(reverse('checkout'), {'contact': self.contact.id}).json()
+        self.assertEqual(response, {'Status': 'OK', 'Order': cart['id']})
+        self.assertEqual(Order.objects.get().status, 'confirmed')
+        self.assertEqual(list(ProductInfo.objects.order_by('id').values_list('quantity', flat=True)), [1, 4])
+        self.assertEqual(list(CatalogOffer.objects.order_by('offer').values_list('quantity', flat=True)), [1, 4])
+        self.assertEqual(self.client.get(url).json(), {'ordered_items': []})
+
+    def test_checkout_out_of_stock_rolls_back(self):
+        add_to_cart(self.user, {self.offers[0]: 1, self.offers[1]: 6})
+        response = self.client.post(reverse('checkout'), {'contact': self.contact.id})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['Items'], [self.offers[1]])
+        self.assertEqual(list(ProductInfo.objects.values_list('quantity', flat=True)), [5, 5])
+        self.assertEqual(Order.objects.get().status, 'cart')
+
+    def test_quantity_out_of_range(self):
+        for item in ({'product_info': self.offers[0], 'quantity': 2 ** 31}, {'product_info': 2 ** 63, 'quantity': 1}):
+            response = self.client.post(reverse('cart'), {'items': [item]}, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+    def test_checkout_locks_offers_last(self):
+        add_to_cart(self.user, {offer: 1 for offer in self.offers})
+        with CaptureQueriesContext(connection) as queries:
+            checkout(self.user, self.contact.id)
+        statements = [query['sql'] for query in queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        first_lock = next(
+            i for i, sql in enumerate(statements) if sql.startswith('UPDATE "suppliers_productinfo"')
+        )
+        self.assertEqual(
+            [sql for sql in statements[first_lock:] if not sql.startswith((
+                'UPDATE "suppliers_productinfo"', 'UPDATE "suppliers_catalogoffer"'
+            ))],
+            []
+        )
+        self.assertEqual(OutgoingEmail.objects.count(), 1)
+
+    def test_remove_from_cart(self):
+        add_to_cart(self.user, {offer: 1 for offer in self.offers})
+        response = self.client.delete(reverse('cart'), {'items': self.offers[:1]}, content_type='application/json')
+        self.assertEqual(response.json(), {'Status': 'OK', 'Deleted': 1})
+
+
+class ConcurrentCheckoutTest(TransactionTestCase):
+
+    def test_no_oversell(self):
+        create_catalog(1, shops=1, parameters=0)
+        ProductInfo.objects.update(quantity=3)
+        refresh_catalog(ProductInfo.objects.all())
+        offer = ProductInfo.objects.get()
+        buyers = [create_buyer(f'buyer{i}@example.com') for i in range(8)]
+        for user, contact in buyers:
+            add_to_cart(user, {offer.id: 1})
+
+        def buy(buyer):
+            user, contact = buyer
+            try:
+                checkout(user, contact.id)
+                return True
+            except OutOfStock:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=len(buyers)) as executor:
+            results = list(executor.map(buy, buyers))
+        self.assertEqual(results.count(True), 3)
+        offer.refresh_from_db()
+        self.assertEqual(offer.quantity, 0)
+
+
+class OrderListViewTest(TestCase):
+
+    def setUp(self):
+        create_catalog(2, shops=1, parameters=0)
+        ProductInfo.objects.update(quantity=100)
+        self.user, self.contact = create_buyer()
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {issue_tokens(self.user)["access"]}'
+        offers = list(ProductInfo.objects.values_list('id', flat=True))
+        for quantity in range(1, 6):
+            add_to_cart(self.user, {offer: quantity for offer in offers})
+            checkout(self.user, self.contact.id)
+        add_to_cart(self.user, {offers[0]: 1})
+
+    def test_totals_in_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('orders') + '?page_size=2')
+        data = response.json()
+        self.assertEqual([(order['item_count'], order['total']) for order in data['results']], [(10, 1000), (8, 800)])
+
+        orders = data['results']
+        while data['next']:
+            data = self.client.get(data['next']).json()
+            orders += data['results']
+        self.assertEqual([order['item_count'] for order in orders], [10, 8, 6, 4, 2])
+
+    def test_status_filter(self):
+        response = self.client.get(reverse('orders') + '?status=cart').json()
+        self.assertEqual([order['total'] for order in response['results']], [100])
+        self.assertEqual(self.client.get(reverse('orders') + '?status=lost').status_code, 400)
+
+
+class SMTPStubHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept messages; rejects the next `server.reject` ones at DATA."""
+
+    def reply(self, text):
+        self.wfile.write(f'{text}\r\n'.encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 stub')
+        while line := self.rfile.readline():
+            command = line.decode().strip().upper()
+            if command == 'DATA':
+                self.reply('354 go ahead')
+                message = b''.join(iter(self.rfile.readline, b'.\r\n'))
+                if self.server.reject:
+                    self.server.reject -= 1
+                    self.reply('451 try again later')
+                else:
+                    self.server.messages.append(message)
+                    self.reply('250 queued')
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+class EmailQueueTest(TestCase):
+
+    def setUp(self):
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SMTPStubHandler)
+        self.server.connections, self.server.messages, self.server.reject = 0, [], 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        smtp = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=self.server.server_address[1], EMAIL_RETRY_DELAY=0,
+        )
+        smtp.enable()
+        self.addCleanup(smtp.disable)
+
+    def test_register_only_queues(self):
+        self.client.post(reverse('register'), {
+            'email': 'buyer@example.com', 'password': 'secret-password',
+            'first_name': 'John', 'last_name': 'Doe', 'type': 'buyer',
+        })
+        email = OutgoingEmail.objects.get()
+        self.assertEqual((email.kind, email.status), ('confirm_email', 'queued'))
+        self.assertEqual(self.server.connections, 0)
+
+    def test_batch_reuses_connection_and_retries(self):
+        for i in range(3):
+            queue_email('order_status', f'buyer{i}@example.com', f'Order #{i}', 'Confirmed')
+        self.server.reject = 1
+
+        self.assertEqual(send_batch(), 3)
+        self.assertEqual(len(self.server.messages), 2)
+        # the rejected email closed the connection, the rest shared a new one
+        self.assertEqual(self.server.connections, 2)
+        failed = OutgoingEmail.objects.get(status='queued')
+        self.assertEqual((failed.subject, failed.attempts), ('Order #0', 1))
+
+        self.assertEqual(send_batch(), 1)
+        self.assertEqual(OutgoingEmail.objects.filter(status='sent').count(), 3)
+        self.assertEqual(send_batch(), 0)
+
+    def test_batch_is_claimed_before_sending(self):
+        for i in range(2):
+            queue_email('order_status', f'buyer{i}@example.com', f'Order #{i}', 'Confirmed')
+        polls, send = [], EmailMessage.send
+
+        def poll_and_send(message, *args, **kwargs):
+            # another worker polling while this batch is on the wire
+            polls.append(send_batch())
+            return send(message, *args, **kwargs)
+
+        with patch.object(EmailMessage, 'send', poll_and_send):
+            self.assertEqual(send_batch(), 2)
+        self.assertEqual(polls, [0, 0])
+        self.assertEqual(OutgoingEmail.objects.filter(status='sent').count(), 2)
+
+    def test_order_status_change_is_queued(self):
+        create_catalog(1, shops=1, parameters=0)
+        user, contact = create_buyer()
+        add_to_cart(user, {ProductInfo.objects.get().id: 1})
+        self.assertFalse(OutgoingEmail.objects.exists())
+        checkout(user, contact.id)
+        email = OutgoingEmail.objects.get()
+        self.assertEqual((email.to, email.kind), ('buyer@example.com', 'order_status'))
+        self.assertEqual(mail.outbox, [])
+
+        order = Order.objects.get()
+        order.save()
+        self.assertEqual(OutgoingEmail.objects.count(), 1)
+        order.status = 'sent'
+        order.save()
+        order.save()
+        self.assertEqual(OutgoingEmail.objects.latest('id').subject, f'Order #{order.id}: Sent')
+        self.assertEqual(OutgoingEmail.objects.count(), 2)
+
+
+class BenchmarkTest(TestCase):
+
+    def test_written_price_list_matches_generated(self):
+        stream = io.StringIO()
+        write_price_list(stream, 'Shop', 5, parameters=2, categories=2)
+        self.assertEqual(yaml.safe_load(stream.getvalue()), price_list('Shop', 5, parameters=2, categories=2))
+
+    def test_measure_catalog(self):
+        generate_catalog(shops=2, products=10, parameters=2)
+        self.assertEqual(CatalogOffer.objects.count(), 20)
+        result = measure(lambda: self.client.get(reverse('products') + '?facets=false'), repeats=3)
+        self.assertEqual((result['status'], result['requests']), (200, 3))
+        self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+
+class ImportPriceListsTest(TransactionTestCase):
+
+    def test_parallel_import_shares_categories_and_parameters(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for i in range(3):
+                with open(f'{directory}/shop{i}.yaml', 'w') as stream:
+                    write_price_list(stream, f'Shop {i}', 20, parameters=3, categories=2, offset=i)
+            output = io.StringIO()
+            call_command('import_pricelists', directory, workers=3, stdout=output)
+
+        self.assertIn('60 offers', output.getvalue())
+        self.assertEqual(Shop.objects.count(), 3)
+        self.assertEqual(Category.objects.count(), 2)
+        self.assertEqual(Parameter.objects.count(), 3)
+        self.assertEqual(Product.objects.count(), 20)
+        self.assertEqual(ProductInfo.objects.count(), 60)
+
+
+class ShopExportTest(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user('seller@example.com', 'secret-password', 'Jane', 'Doe', type='seller')
+        self.shop = Shop.objects.create(name='Shop', url='https://example.com', user=self.seller)
+        PriceListImporter(self.shop).run(price_list('Shop', 5, parameters=2, categories=2))
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {issue_tokens(self.seller)["access"]}'
+        self.url = reverse('shop export', args=[self.shop.id])
+
+    def export(self, output):
+        response = self.client.get(f'{self.url}?output={output}')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_yaml_round_trip(self):
+        self.assertEqual(yaml.safe_load(self.export('yaml')), price_list('Shop', 5, parameters=2, categories=2))
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_csv_and_jsonl(self):
+        rows = list(csv.DictReader(io.StringIO(self.export('csv'))))
+        self.assertEqual([row['id'] for row in rows], ['0', '1', '2', '3', '4'])
+        self.assertEqual(orjson.loads(rows[0]['parameters']), {'Parameter 0': '0', 'Parameter 1': '1'})
+        items = [orjson.loads(line) for line in self.export('jsonl').splitlines()]
+        self.assertEqual(items, price_list('Shop', 5, parameters=2, categories=2)['goods'])
+
+    def test_only_owner(self):
+        other = User.objects.create_user('other@example.com', 'secret-password', 'John', 'Doe', type='seller')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {issue_tokens(other)["access"]}'
+        self.assertEqual(self.client.get(self.url).json()['Error'], 'Shop not found')
+
+
+class OfferPatchViewTest(TestCase):
+
+    def setUp(self):
+        seller = User.objects.create_user('seller@example.com', 'secret-password', 'Jane', 'Doe', type='seller')
+        self.shop = Shop.objects.create(name='Shop', url='https://example.com', user=seller)
+        PriceListImporter(self.shop).run(price_list('Shop', 3, parameters=0, categories=1))
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {issue_tokens(seller)["access"]}'
+
+    def test_patch_prices_and_stock(self):
+        items = [
+            {'external_id': 0, 'price': 55},
+            {'external_id': 1, 'quantity': 1},
+            {'external_id': 2, 'price': 102, 'quantity': 2},
+            {'external_id': 999, 'quantity': 5},
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(reverse('offer patch'), {'items': items}, content_type='application/json')
+        self.assertEqual(response.json(), {'Status': 'OK', 'Updated': 1, 'Unmatched': [999]})
+        self.assertEqual(
+            list(CatalogOffer.objects.order_by('name').values_list('price', 'quantity')),
+            [(55, 0), (101, 1), (102, 2)]
+        )
+
+    def test_invalid_item(self):
+        for item in ({'external_id': 1}, {'external_id': 1, 'price': 2 ** 31}, {'external_id': 2 ** 63, 'quantity': 1}):
+            response = self.client.patch(reverse('offer patch'), {'items': [item]}, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+
+class RequestMetricsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        histograms.reset()
+        create_catalog(2)
+
+    def test_server_timing(self):
+        response = self.client.get(reverse('products'))
+        timings = dict(timing.split(';', 1) for timing in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timings), {'total', 'db', 'render'})
+        self.assertIn('desc="4 queries"', timings['db'])
+
+    def test_metrics_endpoint(self):
+        for _ in range(3):
+            self.client.get(reverse('products'))
+        metrics = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('http_request_duration_seconds_bucket{view="products",le="+Inf"} 3', metrics)
+        self.assertIn('http_request_duration_seconds_count{view="products"} 3', metrics)
+        # the two cached responses ran no queries
+        self.assertIn('http_request_queries_total{view="products"} 4', metrics)
+
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(SLOW_REQUEST_MS=0, SLOW_REQUEST_QUERIES=1)
+    def test_slow_request_logged_with_queries(self):
+        with self.assertLogs('suppliers.metrics', 'WARNING') as logs:
+            self.client.get(reverse('products'))
+        message, = logs.output
+        self.assertIn('Slow request GET /products/', message)
+        self.assertEqual(message.count(' ms: SELECT'), 1)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTest(SimpleTestCase):
+    router = ReplicaRouter()
+    user = TokenUser({'user_id': 1})
+
+    def setUp(self):
+        cache.clear()
+
+    def route(self, request):
+        token = request_routing.set(RequestRouting(request, request.method != 'GET'))
+        self.addCleanup(request_routing.reset, token)
+        return request_routing.get()
+
+    def view(self, request):
+        self.router.db_for_write(Contact)
+        return HttpResponse()
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_safe_request_reads_replica_until_it_writes(self):
+        self.route(RequestFactory().get('/products/'))
+        self.assertEqual(self.router.db_for_read(Product), 'replica')
+        self.router.db_for_write(Product)
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_unsafe_requests_and_atomic_blocks_use_primary(self):
+        self.route(RequestFactory().post('/contact/'))
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+        self.route(RequestFactory().get('/contact/'))
+        with patch.object(connection, 'in_atomic_block', True):
+            self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_writer_is_pinned(self):
+        request = RequestFactory().post('/contact/')
+        request.user = self.user
+        ReplicaMiddleware(self.view)(request)
+        self.assertTrue(cache.get(PINNED_KEY.format(self.user.id)))
+
+        request = RequestFactory().get('/contact/')
+        request.user = self.user
+        self.route(request)
+        self.assertEqual(self.router.db_for_read(Contact), 'default')
+
+    def test_catalog_cache_miss_uses_primary_after_catalog_change(self):
+        request = Request(RequestFactory().get('/products/'))
+        self.route(request)
+        self.assertIsNone(get_cached_catalog(request)[0])
+        self.assertEqual(self.router.db_for_read(Product), 'replica')
+
+        bump_catalog_version(1)
+        self.assertIsNone(get_cached_catalog(request)[0])
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_anonymous_writer_gets_cookie(self):
+        response = ReplicaMiddleware(self.view)(RequestFactory().post('/register/'))
+        self.assertIn(ReplicaMiddleware.cookie_name, response.cookies)
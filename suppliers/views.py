@@ -1,13 +1,32 @@
-import json
+from django.conf import settings
+from django.db import router, transaction
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework import generics, permissions, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.views import APIView
 from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.authtoken.models import Token
-from rest_framework_yaml.parsers import YAMLParser
 
-from .serializers import UserSerializer, LoginSerializer, ProductSerializer, ContactSerializer
-from .models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Contact
+from .authentication import issue_tokens, refresh_tokens, revoke_token, decode_token
+from .serializers import (
+    UserSerializer, LoginSerializer, ProductSerializer, ContactSerializer, ImportJobSerializer,
+    CartItemSerializer, OfferPatchSerializer, OrderSerializer, OrderHistorySerializer,
+)
+from .models import STATUS_CHOICES, Contact, ImportJob, Order, Shop, ProductInfo
+from .filters import CatalogFilter, search_products
+from .catalog import catalog_page, catalog_products, compare_offers
+from .renderers import ORJSONRenderer, MessagePackRenderer
+from .cache import get_cached_catalog, set_cached_catalog, catalog_cache_stats
+from .export import EXPORT_FORMATS
+from .importer import patch_offers
+from .jobs import enqueue_import
+from .metrics import histograms
+from .notifications import queue_confirmation
+from .orders import OutOfStock, add_to_cart, update_cart, remove_from_cart, checkout, order_history
+from .pagination import KeysetPagination, RankPagination, TimeCreatedPagination
+from .parsers import CustomYamlParser, StreamingYamlParser
 
 
 class RegisterView(generics.CreateAPIView):
@@ -17,10 +36,15 @@ class RegisterView(generics.CreateAPIView):
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        user = serializer.save()
-        if user:
+        with transaction.atomic():
+            user = serializer.save()
             token = Token.objects.create(user=user)
-            return Response({'Status': 'OK', 'token': token.key}, status=status.HTTP_201_CREATED)
+            queue_confirmation(user)
+        if user:
+            return Response(
+                {'Status': 'OK', 'token': token.key, **issue_tokens(user)},
+                status=status.HTTP_201_CREATED
+            )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -33,64 +57,223 @@ class LoginView(generics.GenericAPIView):
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data['user']
         token, created = Token.objects.get_or_create(user=user)
-        return Response({'Status': 'OK', 'token': token.key}, status=status.HTTP_200_OK)
+        return Response({'Status': 'OK', 'token': token.key, **issue_tokens(user)}, status=status.HTTP_200_OK)
 
 
-class CustomYamlParser(YAMLParser):
-    media_type = "text/yaml"
+class TokenRefreshView(APIView):
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
+
+    def post(self, request):
+        refresh = request.data.get('refresh')
+        if not refresh:
+            return Response({'Status': 'Failed', 'Error': 'No refresh token provided'})
+        return Response({'Status': 'OK', **refresh_tokens(refresh)})
+
+
+class TokenRevokeView(APIView):
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
+
+    def post(self, request):
+        refresh = request.data.get('refresh')
+        if not refresh:
+            return Response({'Status': 'Failed', 'Error': 'No refresh token provided'})
+        revoke_token(decode_token(refresh, 'refresh'))
+        return Response({'Status': 'OK'})
 
 
 class YAMLLoadView(APIView):
-    parser_classes = (CustomYamlParser,)
+    parser_classes = (StreamingYamlParser, CustomYamlParser)
 
     def post(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response(
                 {
                     'Error': 'Please register or provide token in headers',
-                    'Format': '{Authorization: Token <your_token>} in headers'
+                    'Format': '{Authorization: Token <your_token>} or {Authorization: Bearer <access>} in headers'
                 }
             )
 
         if request.user.type != 'seller':
             return Response({'Error': 'Available only for sellers'})
 
+        parser = request.negotiator.select_parser(request, request.parsers)
+        if parser is None or request.stream is None:
+            return Response({'Status': 'Failed', 'Error': 'Please send price list as text/yaml'})
+
         try:
-            data = request.data
-            shop, created = Shop.objects.get_or_create(name=data['shop'], user_id=request.user.id)
-
-            for category in data['categories']:
-                category_object, created = Category.objects.get_or_create(id=category['id'], name=category['name'])
-                category_object.shops.add(shop.id)
-                category_object.save()
-
-            for item in data['goods']:
-                product, created = Product.objects.get_or_create(name=item['name'], category_id=item['category'])
-
-                product_info = ProductInfo.objects.create(
-                    product_id=product.id,
-                    external_id=item['id'],
-                    model=item['model'],
-                    name=item['name'],
-                    price=item['price'],
-                    price_rrp=item['price_rrc'],
-                    quantity=item['quantity'],
-                    shop_id=shop.id
-                )
-                for name, value in item['parameters'].items():
-                    parameter_object, _ = Parameter.objects.get_or_create(name=name)
-                    ProductParameter.objects.create(product_info_id=product_info.id,
-                                                    parameter_id=parameter_object.id,
-                                                    value=value)
+            job = enqueue_import(request.user, request.stream, streaming=isinstance(parser, StreamingYamlParser))
         except Exception as e:
             return Response({'Status': 'Failed', 'Exception': str(e)})
 
-        return Response({'Status': 'OK', 'data': data})
+        return Response({'Status': 'OK', 'Job': job.id}, status=status.HTTP_202_ACCEPTED)
+
+
+class OfferPatchView(APIView):
+    """
+    Update prices and stock of the seller's shop without a full price list:
+
+        {"items": [{"external_id": <id>, "price": <int>, "quantity": <int>}, ...]}
+
+    Either price or quantity may be left out. Returns the number of changed
+    offers and the external ids the shop has no offer for.
+    """
+
+    def patch(self, request):
+        if not request.user.is_authenticated:
+            return Response({'Status': 'Failed', 'Error': 'Please register or login'})
+
+        if request.user.type != 'seller':
+            return Response({'Error': 'Available only for sellers'})
+
+        shop = Shop.objects.filter(user_id=request.user.id).first()
+        if shop is None:
+            return Response({'Status': 'Failed', 'Error': 'Shop not found'})
+
+        items = request.data.get('items')
+        if not items or not isinstance(items, list):
+            return Response({'Status': 'Failed', 'Error': 'No items provided'})
+        if len(items) > settings.OFFER_PATCH_MAX_ITEMS:
+            return Response({'Status': 'Failed', 'Error': f'At most {settings.OFFER_PATCH_MAX_ITEMS} items'})
+        serializer = OfferPatchSerializer(data=items, many=True)
+        serializer.is_valid(raise_exception=True)
+
+        # the last entry of an external id wins
+        updated, unmatched = patch_offers(shop, {item.pop('external_id'): item for item in serializer.validated_data})
+        return Response({'Status': 'OK', 'Updated': updated, 'Unmatched': unmatched})
+
+
+class ImportJobView(APIView):
+
+    def get(self, request, job_id):
+        if not request.user.is_authenticated:
+            return Response({'Status': 'Failed', 'Error': 'Please register or login'})
+
+        try:
+            job = ImportJob.objects.get(id=job_id, user_id=request.user.id)
+        except ImportJob.DoesNotExist:
+            return Response({'Status': 'Failed', 'Error': 'Import job not found'})
+
+        return Response(ImportJobSerializer(job).data)
+
+
+class ShopExportView(APIView):
+    """
+    Stream all offers of a shop as `?output=yaml` (the /load/ price list
+    format, default), `csv` or `jsonl`. Available to the shop owner and staff.
+    """
+
+    def get(self, request, shop_id):
+        if not request.user.is_authenticated:
+            return Response({'Status': 'Failed', 'Error': 'Please register or login'})
+
+        output = request.query_params.get('output', 'yaml')
+        if output not in EXPORT_FORMATS:
+            return Response({'Status': 'Failed', 'Error': f'Output must be one of {", ".join(EXPORT_FORMATS)}'})
+
+        shops = Shop.objects.all() if request.user.is_staff else Shop.objects.filter(user_id=request.user.id)
+        try:
+            shop = shops.get(id=shop_id)
+        except Shop.DoesNotExist:
+            return Response({'Status': 'Failed', 'Error': 'Shop not found'})
+
+        # the rows are read after the view returns, pick the database now
+        export, content_type = EXPORT_FORMATS[output]
+        response = StreamingHttpResponse(export(shop, router.db_for_read(ProductInfo)), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="shop-{shop.id}.{output}"'
+        return response
 
 
 class ProductListView(ListAPIView):
-    queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = KeysetPagination
+
+    renderer_classes = (ORJSONRenderer, MessagePackRenderer, BrowsableAPIRenderer)
+
+    def get_queryset(self):
+        return self.catalog.products().only('id', 'name')
+
+    def list(self, request, *args, **kwargs):
+        self.catalog = CatalogFilter(request.query_params)
+        data, version = get_cached_catalog(request, self.catalog.shops)
+        if data is not None:
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        if settings.CATALOG_READ_MODEL:
+            position = self.paginator.get_position(request)
+            products = catalog_page(self.catalog, position, self.paginator.page_size + 1)
+            page = self.paginator.get_page(products, lambda product: (product['name'], product['id']))
+            for product in page:
+                del product['id']
+            response = self.paginator.get_paginated_response(page)
+        else:
+            page = self.paginate_queryset(self.get_queryset())
+            response = self.get_paginated_response(catalog_products(page, self.catalog.offers()))
+        # facets are the same for every page of a filter, compute them once
+        if self.catalog.with_facets and not request.query_params.get(self.paginator.cursor_query_param):
+            response.data['facets'] = self.catalog.facets()
+        set_cached_catalog(request, response.data, version)
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+class ProductSearchView(ListAPIView):
+    """
+    Products matching `?q=`, most relevant first, with their offers in the
+    ProductListView layout. Takes the filters of ProductListView too.
+    """
+    serializer_class = ProductSerializer
+    pagination_class = RankPagination
+
+    renderer_classes = (ORJSONRenderer, MessagePackRenderer, BrowsableAPIRenderer)
+
+    def get_queryset(self):
+        text = self.request.query_params.get('q', '').strip()
+        if not text:
+            raise ValidationError({'q': 'Expected a search query'})
+        return search_products(self.catalog.products().only('id', 'name'), text)
+
+    def list(self, request, *args, **kwargs):
+        self.catalog = CatalogFilter(request.query_params)
+        page = self.paginate_queryset(self.get_queryset())
+        return self.get_paginated_response(catalog_products(page, self.catalog.offers()))
+
+
+class ProductComparisonView(ListAPIView):
+    """
+    Cheapest and best-stocked offer per product across shops. Takes the
+    filters of ProductListView; only the matching offers are compared.
+    """
+    pagination_class = KeysetPagination
+
+    renderer_classes = (ORJSONRenderer, MessagePackRenderer, BrowsableAPIRenderer)
+
+    def get_queryset(self):
+        return self.catalog.products().only('id', 'name')
+
+    def list(self, request, *args, **kwargs):
+        self.catalog = CatalogFilter(request.query_params)
+        page = self.paginate_queryset(self.get_queryset())
+        return self.get_paginated_response(compare_offers(page, self.catalog.offers()))
+
+
+class CatalogCacheStatsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(catalog_cache_stats())
+
+
+class MetricsView(APIView):
+    """Per-view latency histograms of this process for the metrics scraper."""
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
+
+    def get(self, request):
+        if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+            return Response({'Status': 'Failed', 'Error': 'Forbidden'}, status=status.HTTP_403_FORBIDDEN)
+        return HttpResponse(histograms.render(), content_type='text/plain; version=0.0.4')
 
 
 class ContactView(APIView):
@@ -134,3 +317,106 @@ class ContactView(APIView):
 
         contact.delete()
         return Response({'Status': 'Success', 'Message': 'Contact deleted successfully'})
+
+
+class CartView(APIView):
+    """
+    The buyer's cart. POST adds quantities, PUT sets them, both taking
+
+        {"items": [{"product_info": <offer id>, "quantity": <int>}, ...]}
+
+    DELETE takes {"items": [<offer id>, ...]}.
+    """
+
+    @staticmethod
+    def get_items(request):
+        serializer = CartItemSerializer(data=request.data.get('items'), many=True)
+        serializer.is_valid(raise_exception=True)
+        items = {}
+        for item in serializer.validated_data:
+            items[item['product_info']] = items.get(item['product_info'], 0) + item['quantity']
+        return items
+
+    def get(self, request):
+        if not request.user.is_authenticated:
+            return Response({'Status': 'Failed', 'Error': 'Please register or login'})
+
+        cart = Order.objects.filter(user_id=request.user.id, status='cart').prefetch_related(
+            'ordered_items__product_info', 'ordered_items__shop'
+        ).first()
+        if cart is None:
+            return Response({'ordered_items': []})
+        return Response(OrderSerializer(cart).data)
+
+    def post(self, request):
+        if not request.user.is_authenticated:
+            return Response({'Status': 'Failed', 'Error': 'Please register or login'})
+
+        items = self.get_items(request)
+        if not items:
+            return Response({'Status': 'Failed', 'Error': 'No items provided'})
+        cart = add_to_cart(request.user, items)
+        return Response({'Status': 'OK', 'Order': cart.id})
+
+    def put(self, request):
+        if not request.user.is_authenticated:
+            return Response({'Status': 'Failed', 'Error': 'Please register or login'})
+
+        items = self.get_items(request)
+        if not items:
+            return Response({'Status': 'Failed', 'Error': 'No items provided'})
+        missing = update_cart(request.user, items)
+        if missing:
+            return Response({'Status': 'Failed', 'Error': 'Offers not in cart', 'Items': missing})
+        return Response({'Status': 'OK'})
+
+    def delete(self, request):
+        if not request.user.is_authenticated:
+            return Response({'Status': 'Failed', 'Error': 'Please register or login'})
+
+        offer_ids = request.data.get('items')
+        if not offer_ids or not isinstance(offer_ids, list):
+            return Response({'Status': 'Failed', 'Error': 'No items provided'})
+        try:
+            offer_ids = [int(offer_id) for offer_id in offer_ids]
+        except (TypeError, ValueError):
+            return Response({'Status': 'Failed', 'Error': 'Expected offer ids'})
+        return Response({'Status': 'OK', 'Deleted': remove_from_cart(request.user, offer_ids)})
+
+
+class CheckoutView(APIView):
+
+    def post(self, request):
+        if not request.user.is_authenticated:
+            return Response({'Status': 'Failed', 'Error': 'Please register or login'})
+
+        try:
+            contact_id = int(request.data.get('contact'))
+        except (TypeError, ValueError):
+            return Response({'Status': 'Failed', 'Error': 'No contact provided'})
+
+        try:
+            order = checkout(request.user, contact_id)
+        except OutOfStock as e:
+            return Response(
+                {'Status': 'Failed', 'Error': 'Not enough stock', 'Items': [e.offer_id]},
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response({'Status': 'OK', 'Order': order.id})
+
+
+class OrderListView(ListAPIView):
+    """The buyer's orders, newest first; `?status=<status>` narrows them down."""
+    serializer_class = OrderHistorySerializer
+    pagination_class = TimeCreatedPagination
+
+    def get_queryset(self):
+        order_status = self.request.query_params.get('status')
+        if order_status and order_status not in dict(STATUS_CHOICES):
+            raise ValidationError({'status': 'Unknown status'})
+        return order_history(self.request.user, order_status)
+
+    def list(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return Response({'Status': 'Failed', 'Error': 'Please register or login'})
+        return super().list(request, *args, **kwargs)
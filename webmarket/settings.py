@@ -10,8 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+from datetime import timedelta
 from pathlib import Path
-from config import DB_PASSWORD, DB_USER
+from config import DB_PASSWORD, DB_USER, DB_HOST, DB_PORT, DB_REPLICAS, EMAIL_HOST, EMAIL_PORT, EMAIL_HOST_USER, EMAIL_HOST_PASSWORD
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -38,12 +39,15 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'suppliers',
     'rest_framework',
     'rest_framework.authtoken',
 ]
 
 MIDDLEWARE = [
+    'suppliers.metrics.RequestMetricsMiddleware',
+    'suppliers.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,11 +87,28 @@ DATABASES = {
         "NAME": "diploma",
         "USER": DB_USER,
         "PASSWORD": DB_PASSWORD,
-        "HOST": "127.0.0.1",
-        "PORT": "5431",
+        "HOST": DB_HOST,
+        "PORT": DB_PORT,
+        # keep connections open across requests, checking them before reuse
+        "CONN_MAX_AGE": 600,
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# Read replicas, used by suppliers.routers.ReplicaRouter. Tests mirror them
+# to the primary.
+for number, replica in enumerate(DB_REPLICAS, 1):
+    host, _, port = replica.partition(':')
+    DATABASES[f"replica{number}"] = {
+        **DATABASES["default"],
+        "HOST": host,
+        "PORT": port or "5432",
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != "default"]
+DATABASE_ROUTERS = ["suppliers.routers.ReplicaRouter"]
+
 
 AUTH_USER_MODEL = "suppliers.User"
 
@@ -135,6 +156,116 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
+        'suppliers.authentication.SignedTokenAuthentication',
         'rest_framework.authentication.TokenAuthentication',
     ),
 }
+
+# Signed access/refresh tokens issued by LoginView and RegisterView and
+# accepted as `Authorization: Bearer <access>`
+SIGNED_TOKENS = {
+    'ACCESS_LIFETIME': timedelta(minutes=5),
+    'REFRESH_LIFETIME': timedelta(days=7),
+    'ALGORITHM': 'HS256',
+    'SIGNING_KEY': SECRET_KEY,
+}
+
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Seconds an idle import worker waits before polling the job queue again
+IMPORT_WORKER_POLL_INTERVAL = 2
+
+# Seconds without a heartbeat (written after every batch) after which a job
+# still marked running is requeued, as its worker is assumed dead; must be
+# longer than the slowest batch
+IMPORT_JOB_TIMEOUT = 600
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Cache alias and lifetime of cached /products/ responses. Entries are also
+# invalidated through per-shop catalog versions whenever offers change; with
+# the per-process local-memory cache the timeout bounds how stale a response
+# can get after an import running in another process.
+CATALOG_CACHE = 'default'
+CATALOG_CACHE_TIMEOUT = 300
+
+# Serve /products/ from the denormalized CatalogOffer read model
+CATALOG_READ_MODEL = True
+
+# Where offer parameters live: 'table' keeps one ProductParameter row per
+# parameter, 'json' keeps them as a JSONB document on ProductInfo.parameters.
+# Run `manage.py copy_parameters_to_json` before switching an existing
+# database to 'json'.
+PRODUCT_PARAMETER_STORAGE = 'table'
+
+# Route /products/, /contact/, /login/ and /register/ to the async views of
+# suppliers.async_views. Only useful when served by an ASGI server
+# (e.g. `uvicorn webmarket.asgi:application`); under WSGI they still work
+# but every request gets its own event loop.
+ASYNC_VIEWS = False
+
+# Threads hashing passwords for the async login and register views
+PASSWORD_HASHING_WORKERS = 4
+
+# Emails are queued as OutgoingEmail rows and sent by `manage.py email_worker`.
+# EMAIL_HOST, EMAIL_PORT and the credentials come from the environment (see
+# config.py); the defaults point at the mailpit SMTP stub of docker-compose.yml.
+EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_TIMEOUT = 10
+DEFAULT_FROM_EMAIL = 'webmarket@example.com'
+
+# Emails sent per SMTP connection, attempts before an email is marked failed,
+# base delay in seconds of the exponential retry backoff and idle poll interval
+EMAIL_BATCH_SIZE = 100
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_DELAY = 30
+EMAIL_WORKER_POLL_INTERVAL = 2
+
+# Seconds a claimed batch of emails is hidden from other email workers; must be
+# longer than sending a batch takes, or its emails may go out twice
+EMAIL_CLAIM_TIMEOUT = 600
+
+# Request instrumentation (suppliers.metrics): requests slower than
+# SLOW_REQUEST_MS are logged with their SLOW_REQUEST_QUERIES slowest queries
+# (cut to SLOW_REQUEST_SQL_LENGTH characters). /metrics/ serves the latency
+# histograms, bucketed by METRICS_LATENCY_BUCKETS (seconds), to these addresses.
+SLOW_REQUEST_MS = 500
+SLOW_REQUEST_QUERIES = 5
+SLOW_REQUEST_SQL_LENGTH = 1000
+METRICS_LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+METRICS_ALLOWED_IPS = ['127.0.0.1']
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'suppliers.metrics': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+    },
+}
+
+# Seconds reads of a client stay on the primary after it wrote, longer than
+# the expected replication lag; the pins of authenticated users are kept in
+# this cache, which must be shared by all web processes in production. Catalog
+# responses computed on a cache miss within that time after a catalog change
+# are read from the primary as well.
+REPLICA_PIN_SECONDS = 5
+REPLICA_PIN_CACHE = 'default'
+
+# Rows fetched per round trip by the server-side cursor of shop exports
+# (/shops/<id>/export/ and `manage.py export_shop`)
+EXPORT_CHUNK_SIZE = 2000
+
+# Largest number of offers a single PATCH /load/offers/ may update
+OFFER_PATCH_MAX_ITEMS = 10000
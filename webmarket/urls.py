@@ -14,15 +14,38 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
-from suppliers.views import RegisterView, LoginView, YAMLLoadView, ProductListView, ContactView
+from suppliers.views import (
+    RegisterView, LoginView, TokenRefreshView, TokenRevokeView, YAMLLoadView, ImportJobView,
+    ProductListView, CatalogCacheStatsView, ContactView, CartView, CheckoutView,
+    OrderListView, MetricsView, ShopExportView, ProductComparisonView, ProductSearchView, OfferPatchView,
+)
+from suppliers.async_views import AsyncRegisterView, AsyncLoginView, AsyncProductListView, AsyncContactView
+
+register_view = AsyncRegisterView if settings.ASYNC_VIEWS else RegisterView
+login_view = AsyncLoginView if settings.ASYNC_VIEWS else LoginView
+product_list_view = AsyncProductListView if settings.ASYNC_VIEWS else ProductListView
+contact_view = AsyncContactView if settings.ASYNC_VIEWS else ContactView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('register/', RegisterView.as_view(), name='register'),
-    path('login/', LoginView.as_view(), name='login'),
+    path('register/', register_view.as_view(), name='register'),
+    path('login/', login_view.as_view(), name='login'),
+    path('token/refresh/', TokenRefreshView.as_view(), name='token refresh'),
+    path('token/revoke/', TokenRevokeView.as_view(), name='token revoke'),
     path('load/', YAMLLoadView.as_view(), name='yaml load'),
-    path('products/', ProductListView.as_view(), name='products'),
-    path('contact/', ContactView.as_view(), name='contact'),
+    path('load/offers/', OfferPatchView.as_view(), name='offer patch'),
+    path('load/<int:job_id>/', ImportJobView.as_view(), name='import job'),
+    path('shops/<int:shop_id>/export/', ShopExportView.as_view(), name='shop export'),
+    path('products/', product_list_view.as_view(), name='products'),
+    path('products/search/', ProductSearchView.as_view(), name='product search'),
+    path('products/compare/', ProductComparisonView.as_view(), name='product comparison'),
+    path('products/cache/', CatalogCacheStatsView.as_view(), name='products cache'),
+    path('contact/', contact_view.as_view(), name='contact'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('cart/', CartView.as_view(), name='cart'),
+    path('cart/checkout/', CheckoutView.as_view(), name='checkout'),
+    path('orders/', OrderListView.as_view(), name='orders'),
 ]